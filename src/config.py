@@ -28,6 +28,10 @@ def parse_args() :
     parser.add_argument('--visualize_training', type=str2bool, default=True)
     parser.add_argument('--snap_step', type=int, default=500)
     parser.add_argument('--dloadworkers', type=int, default=3)
+    parser.add_argument('--prefetch', type=str2bool, default=True)
+    parser.add_argument('--shared_metadata', type=str2bool, default=False) # spawn the loader workers and give them the dataset metadata in shared memory instead of copies
+    parser.add_argument('--loader', type=str, default='default') # default, stream (coupled only), device (digits only), thread
+    parser.add_argument('--loadthreads', type=int, default=4) # threads of the thread loader
     #### saving training images #####
     parser.add_argument('--vis_dim', type=int, default=6)
     #### plotting ####
@@ -46,7 +50,9 @@ def parse_args() :
     parser.add_argument('--epochs', type=int, default=20)
     parser.add_argument('--k', type=int, default=1)
     parser.add_argument('--G_updates', type=int, default=1)
+    parser.add_argument('--reuse_fake', type=str2bool, default=False) # k == 1 and G_updates == 1: the G update uses the fake batch of the D update instead of a new one
     parser.add_argument('--labelsmoothing', type=str2bool, default=True)
+    parser.add_argument('--seed', type=int, default=None) # makes the data streams and weight initialization reproducible
     
     #### GAN type ####
     parser.add_argument('--coupled', type=str2bool, default=True)
@@ -57,7 +63,10 @@ def parse_args() :
     parser.add_argument('--combined', type=str2bool, default=False)
     parser.add_argument('--dataname', type=str, default="MNIST")
     parser.add_argument('--dataname2', type=str, default=None)
+    parser.add_argument('--celeba_root', type=str, default='../data/celeba/') # folder with the images, or img_align_celeba.zip
+    parser.add_argument('--celeba_shards', type=str, default=None) # folder made by preprocess_celeba.py --shards, streams CelebA from it
     parser.add_argument('--cropsize', type=int, default=160)
+    parser.add_argument('--edge_thresholds', nargs='+', type=float, default=None) # MNISTCANNY/MNISTEDGE on the fly: low high, or low_min low_max high_min high_max
     # Coupled
     parser.add_argument('--batches', type=int,  default=25000)
     parser.add_argument('--balance', type=str2bool, default=True)
@@ -75,8 +84,11 @@ def parse_args() :
     parser.add_argument('--algorithm', type=str, default='default')
     parser.add_argument('--c_algorithm', type=str, default='default')
     parser.add_argument('--gp_coef', type=int, default=10)
+    parser.add_argument('--fused_d', type=str2bool, default=False) # one D pass over the fake, real and interpolated batches
 
     #### Model params ####
+    parser.add_argument('--shared_trunk', type=str2bool, default=False) # coupled dcgan/cogan: one pass of both domains through the shared layers
+    parser.add_argument('--trunk_norm', type=str, default='domain') # domain: batch norm statistics per domain in the shared layers, joint: over both
     parser.add_argument('--imsize', type=int, default=64)
     parser.add_argument('--imgch', type=int, default=1)
     parser.add_argument('--weight_init', type=str, default='normal')
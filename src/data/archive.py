@@ -0,0 +1,95 @@
+import os
+import io
+import struct
+import zipfile
+import zlib
+import numpy as np
+
+from data import shared
+
+# Reads members of a zip archive without extracting it. The central directory is read once and stored in
+# <archive>_index.npz next to the archive: the member names and, for every member, the offset of its local header,
+# its compressed size and its compression method. The index is rebuilt when the archive is newer than it.
+def load_zip_index(zip_name):
+    npz_name = zip_name[:-len('.zip')] + '_index.npz'
+    if not os.path.exists(npz_name) or os.path.getmtime(npz_name) < os.path.getmtime(zip_name):
+        build_zip_index(zip_name, npz_name)
+    with np.load(npz_name) as f:
+        return f['names'], f['offsets'], f['sizes'], f['methods']
+
+def build_zip_index(zip_name, npz_name):
+    print("Creating index of " + zip_name + "...")
+    with zipfile.ZipFile(zip_name) as z:
+        infos = [info for info in z.infolist() if not info.is_dir()]
+    names = np.array([os.fsencode(info.filename) for info in infos])
+    offsets = np.array([info.header_offset for info in infos], dtype=np.int64)
+    sizes = np.array([info.compress_size for info in infos], dtype=np.int64)
+    methods = np.array([info.compress_type for info in infos], dtype=np.int64)
+
+    tmp_name = npz_name[:-len('.npz')] + '_tmp.npz'
+    np.savez(tmp_name, names=names, offsets=offsets, sizes=sizes, methods=methods)
+    os.replace(tmp_name, npz_name)
+    print("Index saved.")
+
+# signature, version, flags, method, time, date, crc, compressed size, size, name length, extra length
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+
+# Every process opens its own handle to the archive, DataLoader workers receive a copy without it.
+# Members are read with pread, so threads can share the handle.
+class ZipArchive():
+    def __init__(self, zip_name):
+        self.zip_name = zip_name
+        self.names, self.offsets, self.sizes, self.methods = load_zip_index(zip_name)
+        self.fd = None
+        self.pid = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        state = shared.getstate(self, ['names', 'offsets', 'sizes', 'methods'])
+        state['fd'] = None
+        return state
+
+    def __setstate__(self, state):
+        shared.setstate(self, state)
+
+    def __del__(self):
+        if not self.fd is None and self.pid == os.getpid():
+            os.close(self.fd)
+
+    def get_fd(self):
+        if self.fd is None or self.pid != os.getpid():
+            self.fd = os.open(self.zip_name, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            self.pid = os.getpid()
+        return self.fd
+
+    # Positions of the members with the given file names, in any directory of the archive
+    def find(self, filenames):
+        positions = {}
+        for pos, name in enumerate(self.names):
+            basename = os.path.basename(os.fsdecode(name))
+            if basename in positions:
+                raise RuntimeError('file name in ' + self.zip_name + ' is not unique: ' + basename)
+            positions[basename] = pos
+        missing = [name for name in filenames if not name in positions]
+        if len(missing) > 0:
+            raise RuntimeError(str(len(missing)) + ' files are missing from ' + self.zip_name + ', e.g. ' + missing[0])
+        return np.array([positions[name] for name in filenames], dtype=np.int64)
+
+    def read(self, pos):
+        fd = self.get_fd()
+        header = os.pread(fd, LOCAL_HEADER.size, int(self.offsets[pos]))
+        fields = LOCAL_HEADER.unpack(header)
+        if fields[0] != 0x04034b50:
+            raise RuntimeError('invalid local header in ' + self.zip_name + ' for ' + os.fsdecode(self.names[pos]))
+        start = int(self.offsets[pos]) + LOCAL_HEADER.size + fields[9] + fields[10]
+        data = os.pread(fd, int(self.sizes[pos]), start)
+        if self.methods[pos] == zipfile.ZIP_STORED:
+            return data
+        if self.methods[pos] == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -15)
+        raise RuntimeError('compression method has unknown value: ' + str(self.methods[pos]))
+
+    def open(self, pos):
+        return io.BytesIO(self.read(pos))
@@ -0,0 +1,20 @@
+from torch.utils.data.dataloader import default_collate
+
+# The datasets in this package implement __getitems__, which the DataLoader calls with the indices of a whole batch.
+# It returns the batch already stacked, wrapped in Batch so that collate passes it on instead of collating it again.
+# Use collate as collate_fn of DataLoaders over these datasets.
+class Batch(tuple):
+    pass
+
+def stack(samples):
+    return Batch(default_collate(samples))
+
+def collate(data):
+    if isinstance(data, Batch):
+        return list(data)
+    return default_collate(data)
+
+def get_batch(dataset, idcs):
+    if hasattr(dataset, '__getitems__'):
+        return dataset.__getitems__(idcs)
+    return stack([dataset[idx] for idx in idcs])
@@ -0,0 +1,58 @@
+import os
+import hashlib
+import numpy as np
+
+# Arrays of preprocessed uint8 samples that are stored on disk once and memory-mapped afterwards.
+# The arrays are written to temporary files first, so an interrupted build never leaves a broken cache behind.
+# Every cache is stored with a fingerprint of the source data and settings it was built from, in <cache>.sha1.
+# A cache is only used when its fingerprint and shape match, like the label dictionaries in labelindex.py.
+def fingerprint(*parts):
+    sha1 = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            sha1.update(np.ascontiguousarray(part).tobytes())
+        else:
+            sha1.update(repr(part).encode())
+    return sha1.hexdigest()
+
+def matches(filename, fingerprint, n, shape):
+    if not os.path.exists(filename):
+        return False
+    sha1_name = filename + '.sha1'
+    if os.path.exists(sha1_name):
+        with open(sha1_name) as f:
+            stored = f.read()
+        arr = load(filename)
+        if stored == fingerprint and arr.dtype == np.uint8 and arr.shape == (n,) + tuple(shape):
+            return True
+    print("Cache " + filename + " does not match the dataset.")
+    return False
+
+def build(filename, n, shape, fill, fingerprint):
+    build_many([filename], n, [shape], lambda idx: [fill(idx)], [fingerprint])
+
+# Fills several arrays in one pass, fill(idx) returns one sample for each of them
+def build_many(filenames, n, shapes, fill, fingerprints):
+    for filename in filenames:
+        print("Creating cache " + filename + "...")
+    tmp_names = [filename + '.tmp' for filename in filenames]
+    arrs = [np.lib.format.open_memmap(tmp_name, mode='w+', dtype=np.uint8, shape=(n,) + tuple(shape))
+            for tmp_name, shape in zip(tmp_names, shapes)]
+    print("\r" + str(0) + '/' + str(n), end='\r')
+    for idx in range(n):
+        for arr, sample in zip(arrs, fill(idx)):
+            arr[idx] = sample
+        if (idx+1) % 1000 == 0 or idx+1 == n:
+            print("\r" + str(idx+1) + '/' + str(n), end='\r')
+    for arr in arrs:
+        arr.flush()
+    del arrs
+    for tmp_name, filename, fingerprint in zip(tmp_names, filenames, fingerprints):
+        os.replace(tmp_name, filename)
+        with open(filename + '.sha1.tmp', 'w') as f:
+            f.write(fingerprint)
+        os.replace(filename + '.sha1.tmp', filename + '.sha1')
+    print("Cache saved.")
+
+def load(filename):
+    return np.load(filename, mmap_mode='r')
@@ -2,69 +2,285 @@ from torchvision import datasets as dset
 from torchvision import transforms
 import torch
 import os
+import math
 import numpy as np
-import random
+from PIL import Image
 
+from data import cache
+from data import shared
+from data.archive import ZipArchive
+from data.rng import get_rng
+from data.batch import Batch
+from torch.utils.data.dataloader import default_collate
+
+# list_attr_celeba.txt is parsed once into list_attr_celeba.npz next to it: the attribute names,
+# the image file names and an int8 matrix with one row of 1/-1 attribute values per image.
+# The cache is rebuilt whenever the text file is newer than it.
+def load_attributes(root):
+    txt_name = os.path.join(root, "list_attr_celeba.txt")
+    npz_name = os.path.join(root, "list_attr_celeba.npz")
+    if not os.path.exists(npz_name) or os.path.getmtime(npz_name) < os.path.getmtime(txt_name):
+        build_attributes(txt_name, npz_name)
+    with np.load(npz_name) as f:
+        return list(f['names']), f['filenames'], f['attrs']
+
+def build_attributes(txt_name, npz_name):
+    print("Creating attribute cache...")
+    with open(txt_name) as f:
+        contents = list(f)
+    names = contents[1].split()
+    rows = [line.split() for line in contents[2:] if line.strip()]
+    filenames = np.array([row[0] for row in rows])
+    attrs = np.array([row[1:] for row in rows], dtype=np.int8)
+
+    tmp_name = npz_name[:-len('.npz')] + '_tmp.npz'
+    np.savez(tmp_name, names=np.array(names), filenames=filenames, attrs=attrs)
+    os.replace(tmp_name, npz_name)
+    print("Attribute cache saved.")
+
+# Paths of the images relative to root as a flat array of byte strings, with path idx belonging to attribute row idx.
+# The paths are looked up by file name once and stored in files_celeba.npz together with the file names they were
+# matched to. The manifest is rebuilt when those no longer equal the file names of the attribute rows.
+def load_files(root, filenames):
+    npz_name = os.path.join(root, "files_celeba.npz")
+    if os.path.exists(npz_name):
+        with np.load(npz_name) as f:
+            if np.array_equal(f['filenames'], filenames):
+                return f['files']
+        print("File manifest " + npz_name + " does not match the attributes.")
+    return build_files(root, filenames, npz_name)
+
+def build_files(root, filenames, npz_name):
+    print("Creating file manifest...")
+    paths = {}
+    for dirpath, _, names in os.walk(root, followlinks=True):
+        for name in names:
+            if not dset.folder.has_file_allowed_extension(name, dset.folder.IMG_EXTENSIONS):
+                continue
+            if name in paths:
+                raise RuntimeError('image file name is not unique: ' + name)
+            paths[name] = os.path.relpath(os.path.join(dirpath, name), root)
+    missing = [name for name in filenames if not name in paths]
+    if len(missing) > 0:
+        raise RuntimeError(str(len(missing)) + ' images of the attribute file are missing, e.g. ' + missing[0])
+    files = np.array([os.fsencode(paths[name]) for name in filenames])
+
+    tmp_name = npz_name[:-len('.npz')] + '_tmp.npz'
+    np.savez(tmp_name, filenames=filenames, files=files)
+    os.replace(tmp_name, npz_name)
+    print("File manifest saved.")
+    return files
+
+# root is a folder with the images, or a zip archive of them with the attribute file next to it.
+# The attribute file and all caches are in data_folder(root).
+def data_folder(root):
+    if root.endswith('.zip'):
+        return os.path.dirname(root)
+    return root
+
+# The images of the attribute rows, open(idx) opens the image of row idx as a binary file
+def load_images(root, filenames):
+    if root.endswith('.zip'):
+        return ArchiveImages(ZipArchive(root), filenames)
+    return ImageDir(root, filenames)
+
+class ImageDir():
+    def __init__(self, root, filenames):
+        self.root = root
+        self.files = load_files(root, filenames)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getstate__(self):
+        return shared.getstate(self, ['files'])
+
+    def __setstate__(self, state):
+        shared.setstate(self, state)
+
+    def open(self, idx):
+        return open(os.path.join(self.root, os.fsdecode(self.files[idx])), 'rb')
+
+class ArchiveImages():
+    def __init__(self, archive, filenames):
+        self.archive = archive
+        self.members = archive.find(filenames)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __getstate__(self):
+        return shared.getstate(self, ['members'])
+
+    def __setstate__(self, state):
+        shared.setstate(self, state)
+
+    def open(self, idx):
+        return self.archive.open(self.members[idx])
+
+def center_crop_box(size, cropsize):
+    w, h = size
+    left = int(round((w - cropsize) / 2.))
+    top = int(round((h - cropsize) / 2.))
+    return (left, top, left + cropsize, top + cropsize)
+
+# Decodes an opened image that will be center-cropped to cropsize and resized to imsize. JPEGs are decoded at a reduced
+# scale (1/2, 1/4 or 1/8, in the DCT domain) as long as the crop keeps at least imsize pixels.
+# Returns the image and its size before the reduction.
+def decode_scaled(img, cropsize, imsize):
+    size = img.size
+    if imsize < cropsize:
+        img.draft('RGB', (math.ceil(size[0] * imsize / cropsize), math.ceil(size[1] * imsize / cropsize)))
+    return img.convert('RGB'), size
+
+# Center crop and resize in a single resampling step. size is the size of the image before decode_scaled reduced it,
+# the crop box is given in those coordinates.
+def crop_and_scale(img, cropsize, imsize, size=None):
+    if size is None:
+        size = img.size
+    # the reduced image has one pixel per factor x factor block of the original, the last one possibly partial
+    factor = round(size[0] / img.size[0])
+    box = tuple(c / factor for c in center_crop_box(size, cropsize))
+    return img.resize((imsize, imsize), Image.BILINEAR, box=box)
+
+# (..., H, W, C) uint8 to (..., C, H, W) float in [0,1]
+def to_tensor(img):
+    return torch.from_numpy(np.array(img)).transpose(-1, -3).transpose(-1, -2).float().div_(255)
+
+def store_name(root, cropsize, imsize):
+    return os.path.join(root, 'store_'+str(cropsize)+'_'+str(imsize)+'.npy')
+
+def store_fingerprint(filenames, cropsize, imsize):
+    return cache.fingerprint(np.asarray(filenames), cropsize, imsize)
+
+# Decodes every image once and stores it center-cropped and resized to each of the sizes in imsizes,
+# as uint8 arrays of shape (images, imsize, imsize, 3) in the order of the attribute rows.
+def build_store(root, cropsize, imsizes):
+    _, filenames, _ = load_attributes(data_folder(root))
+    images = load_images(root, filenames)
+    def fill(idx):
+        with images.open(idx) as f:
+            img, size = decode_scaled(Image.open(f), cropsize, max(imsizes))
+        return [np.array(crop_and_scale(img, cropsize, imsize, size)) for imsize in imsizes]
+
+    store_names = [store_name(data_folder(root), cropsize, imsize) for imsize in imsizes]
+    shapes = [(imsize, imsize, 3) for imsize in imsizes]
+    fingerprints = [store_fingerprint(filenames, cropsize, imsize) for imsize in imsizes]
+    cache.build_many(store_names, len(images), shapes, fill, fingerprints)
+
+# Rows of attrs that are labeled correctly for the given labels and domain, and the labels in labelnames of those rows,
+# 1 for true and 0 for false
+def select_rows(all_labelnames, attrs, labelnames, pos_labels, neg_labels, domain_label=None, domain_val=None):
+    label_idcs = [all_labelnames.index(name) for name in labelnames]
+    pos_idcs   = [all_labelnames.index(name) for name in pos_labels]
+    neg_idcs   = [all_labelnames.index(name) for name in neg_labels]
+
+    valid = np.ones(len(attrs), dtype=bool)
+    if not domain_label is None:
+        domain_idx = all_labelnames.index(domain_label)
+        valid &= attrs[:, domain_idx] == (1 if domain_val == 1 else -1)
+    if not (pos_labels==[] and neg_labels==[]):
+        valid &= (attrs[:, pos_idcs] == 1).any(1) | (attrs[:, neg_idcs] != 1).any(1)
+
+    rows = np.nonzero(valid)[0]
+    return rows, (attrs[rows][:, label_idcs] == 1).astype(np.int64)
+
+# If cropsize and imsize are given, images are center-cropped and resized by the dataset itself, and transform is applied
+# to the resulting [0,1] float tensors. When a store for that size exists (see build_store), images are read from it.
+# A store that does not match the attribute file is not used, and needs to be built again.
+# Otherwise transform receives the full size PIL images.
 class CelebA_dataset(torch.utils.data.Dataset):
-    def __init__(self, labelnames=["Male"], pos_labels=[], neg_labels=[], domain_label=None, domain_val=None, root='../../../data/celeba/', transform=None, labeltype='bool') :
-        self.img_dataset = dset.ImageFolder(root=root, transform=transform)
+    def __init__(self, labelnames=["Male"], pos_labels=[], neg_labels=[], domain_label=None, domain_val=None, root='../../../data/celeba/', transform=None, labeltype='bool', cropsize=None, imsize=None) :
+        self.cropsize = cropsize
+        self.imsize = imsize
+        self.transform = transform
+        self.store = None
         self.labelnames = labelnames
         self.labeltype = labeltype
 
-        with open(os.path.join(root, "list_attr_celeba.txt")) as f:
-            contents= list(f)
+        self.domain_label = domain_label
+        self.domain_val = domain_val
 
-        all_labelnames = contents[1].split()
-        
-        if not domain_label is None:
-            domain_val = '1' if domain_val == 1 else '-1'
-            domain_idx = self.names_to_idcs(all_labelnames, [domain_label])[0]
-        label_idcs = self.names_to_idcs(all_labelnames, labelnames)
-        pos_idcs   = self.names_to_idcs(all_labelnames, pos_labels)
-        neg_idcs   = self.names_to_idcs(all_labelnames, neg_labels)
-
-        contents = contents[2:]
-        self.labels = {}
-        self.valid_idcs = []
-        true, false = 1, 0
-        for idx in range(len(contents)):
-            y = contents[idx].split()
-
-            # check if labeled correctly
-            if domain_label is None or y[domain_idx] == domain_val:
-                usinglabels = pos_labels==[] and neg_labels==[]
-                validlabels = any([y[i] == '1' for i in pos_idcs]) or any([y[i] != '1' for i in neg_idcs])
-                if usinglabels or validlabels:    
-                    y = [true if y[i] == '1' else false for i in label_idcs]
-                    self.valid_idcs += [idx]
-                    self.labels[idx] = y
-
-    def names_to_idcs(self, all_labelnames, labels):
-        idcs = []
-        for labelname in labels:
-            idcs += [all_labelnames.index(labelname) + 1] # +1 to ignore the file name entry
-        return idcs
+        self.all_labelnames, filenames, self.attrs = load_attributes(data_folder(root))
+        self.images = load_images(root, filenames)
+
+        self.store_file_name = None
+        if not imsize is None and os.path.exists(store_name(data_folder(root), cropsize, imsize)):
+            fingerprint = store_fingerprint(filenames, cropsize, imsize)
+            if cache.matches(store_name(data_folder(root), cropsize, imsize), fingerprint, len(filenames), (imsize, imsize, 3)):
+                self.store_file_name = store_name(data_folder(root), cropsize, imsize)
+        self.neg_labels = neg_labels
+        self.set_labels(pos_labels)
+
+    # Re-filters the dataset in place, without reloading the images or the attributes.
+    # neg_labels=None keeps the current negative labels.
+    def set_labels(self, pos_labels, neg_labels=None):
+        if not neg_labels is None:
+            self.neg_labels = neg_labels
+        # valid images and their labels in dataset order
+        self.valid_idcs, self.label_array = select_rows(self.all_labelnames, self.attrs, self.labelnames,
+            pos_labels, self.neg_labels, self.domain_label, self.domain_val)
 
     def __len__(self):
         return len(self.valid_idcs)
 
+    # The memory map is opened lazily, so that every DataLoader worker opens its own instead of receiving a pickled copy
+    def __getstate__(self):
+        state = shared.getstate(self, ['attrs', 'valid_idcs', 'label_array'])
+        state['store'] = None
+        return state
+
+    def __setstate__(self, state):
+        shared.setstate(self, state)
+
+    def get_store(self):
+        if self.store is None:
+            self.store = cache.load(self.store_file_name)
+        return self.store
+
+
+    def random_positions(self, size=None):
+        return get_rng().randint(len(self), size=size)
 
     def get_random_labelbatch(self, batch_size):
-        np.random.seed()
-        ys = []
-        for it in range(batch_size):
-            idx = np.random.randint(len(self))
-            idx2 = self.valid_idcs[idx]
-            label = self.get_y(idx2).unsqueeze(0)
-            ys += [label]
-        return torch.cat(ys, 0)
+        idcs = self.random_positions(batch_size)
+        return torch.from_numpy(self.label_array[idcs])
 
     def get_y(self, idx):
-        return torch.LongTensor(self.labels[idx])
+        return torch.from_numpy(self.label_array[idx])
         
+    def get_img(self, idx2):
+        if self.imsize is None:
+            with self.images.open(idx2) as f:
+                img = Image.open(f).convert('RGB')
+            if self.transform:
+                img = self.transform(img)
+            return img
+        if self.store_file_name is None:
+            with self.images.open(idx2) as f:
+                img, size = decode_scaled(Image.open(f), self.cropsize, self.imsize)
+            img = to_tensor(crop_and_scale(img, self.cropsize, self.imsize, size))
+        else:
+            img = to_tensor(self.get_store()[idx2])
+        if self.transform:
+            img = self.transform(img)
+        return img
+
+    def get_imgs(self, idcs2):
+        if self.store_file_name is None:
+            return default_collate([self.get_img(idx2) for idx2 in idcs2])
+        imgs = to_tensor(self.get_store()[idcs2])
+        if self.transform:
+            imgs = self.transform(imgs)
+        return imgs
+
     def __getitem__(self, idx):
         idx2 = self.valid_idcs[idx]
-        return self.img_dataset[idx2][0], self.get_y(idx2)
+        return self.get_img(idx2), self.get_y(idx)
+
+    def __getitems__(self, idcs):
+        idcs = np.asarray(idcs, dtype=np.int64)
+        return Batch((self.get_imgs(self.valid_idcs[idcs]), self.get_y(idcs)))
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
@@ -2,6 +2,9 @@ from torch.utils.data import Dataset
 import numpy as np
 import torch
 
+from data.rng import get_rng
+from data.batch import Batch, get_batch
+
 #Samples randomly from dataset1 and dataset2.
 class CombinedDataset(Dataset) :
     def __init__(self, dataset1, dataset2) :
@@ -9,24 +12,40 @@ class CombinedDataset(Dataset) :
         self.dataset2 = dataset2
         self.length = len(dataset1) + len(dataset2)
 
+    # Re-filters both datasets in place
+    def set_labels(self, labels1, labels2):
+        self.dataset1.set_labels(labels1)
+        self.dataset2.set_labels(labels2)
+        self.length = len(self.dataset1) + len(self.dataset2)
+
     def __len__(self):
         return self.length
 
     
     def get_random_labelbatch(self, batchsize):
-        d1count = 0
-        d2count = 0
-        for it in range(batchsize):
-            n = np.random.randint(self.length)
-            if n < len(self.dataset1):
-                d1count += 1
-            else:
-                d2count += 1
+        ns = get_rng().randint(self.length, size=batchsize)
+        d1count = int((ns < len(self.dataset1)).sum())
+        d2count = batchsize - d1count
         batch1 = self.dataset1.get_random_labelbatch(d1count)
         batch2 = self.dataset2.get_random_labelbatch(d2count)
         return torch.cat([batch1, batch2], 0)
         
         
+    def __getitems__(self, idcs):
+        idcs = np.asarray(idcs, dtype=np.int64)
+        first = idcs < len(self.dataset1)
+        if first.all():
+            return get_batch(self.dataset1, idcs)
+        if not first.any():
+            return get_batch(self.dataset2, idcs - len(self.dataset1))
+        batch1 = get_batch(self.dataset1, idcs[first])
+        batch2 = get_batch(self.dataset2, idcs[~first] - len(self.dataset1))
+
+        # restore the order of idcs
+        order = np.concatenate([np.nonzero(first)[0], np.nonzero(~first)[0]])
+        inverse = torch.from_numpy(np.argsort(order))
+        return Batch([torch.cat([t1, t2], 0)[inverse] for t1, t2 in zip(batch1, batch2)])
+
     def __getitem__(self, idx):
         if idx < len(self.dataset1):
             return self.dataset1[idx]
@@ -1,25 +1,58 @@
 from torch.utils.data import Dataset
 import numpy as np
 
+from data.sampler import balanced_probs
+from data.batch import Batch, get_batch
+
 #Samples randomly from dataset1 and dataset2.
+#With config.balance, digit datasets with different labels draw their labels such that both domains together are balanced.
 class CoupledDataset(Dataset) :
     def __init__(self, config, dataset1, dataset2) :
+        self.config = config
         self.dataset1 = dataset1
         self.dataset2 = dataset2
-        self.length = config.batches * config.mini_batch_size
+        self.balance()
+
+    def balance(self):
+        if not self.config.balance:
+            return
+        if hasattr(self.dataset1, 'set_label_probs') and hasattr(self.dataset2, 'set_label_probs'):
+            if not list(self.dataset1.labels) == list(self.dataset2.labels):
+                probs1, probs2 = balanced_probs(self.dataset1.labels, self.dataset2.labels)
+                self.dataset1.set_label_probs(probs1)
+                self.dataset2.set_label_probs(probs2)
 
+    # Re-filters both datasets in place and balances their labels again
+    def set_labels(self, labels1, labels2):
+        self.dataset1.set_labels(labels1)
+        self.dataset2.set_labels(labels2)
+        self.balance()
+
+    # Follows config.batches, which may change between training stages
     def __len__(self):
-        return self.length
+        return self.config.batches * self.config.mini_batch_size
 
     def get_random_labelbatch(self, batchsize):
         c1 = self.dataset1.get_random_labelbatch(batchsize)
         c2 = self.dataset2.get_random_labelbatch(batchsize)
         return c1, c2
 
+    def get_random_batch(self, batch_size):
+        idcs1 = self.dataset1.random_positions(batch_size)
+        idcs2 = self.dataset2.random_positions(batch_size)
+
+        im1, lab1 = get_batch(self.dataset1, idcs1)
+        im2, lab2 = get_batch(self.dataset2, idcs2)
+
+        return im1, im2, lab1, lab2
+
+    #idcs is only used for the batch size
+    def __getitems__(self, idcs):
+        return Batch(self.get_random_batch(len(idcs)))
+
     def __getitem__(self, idx):
-        np.random.seed()
-        idx1 = np.random.randint(len(self.dataset1))
-        idx2 = np.random.randint(len(self.dataset2))
+        idx1 = self.dataset1.random_positions()
+        idx2 = self.dataset2.random_positions()
         
         im1, lab1 = self.dataset1[idx1]
         im2, lab2 = self.dataset2[idx2]
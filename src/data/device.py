@@ -0,0 +1,58 @@
+import numpy as np
+import torch
+
+import utils
+from data import rng
+from data.batch import get_batch
+
+# Keeps all samples of a filtered digit dataset as tensors on the training device, so that batches are drawn by tensor
+# indexing instead of through a DataLoader. Datasets with a uint8 cache (MNIST with imsize) are stored as uint8 and
+# converted per batch, other datasets are stored as the float tensors they return.
+# Batches are drawn with generators of the dataset, so that draws on the prefetch thread are reproducible.
+class DeviceDataset():
+    def __init__(self, dataset):
+        print("Moving dataset to device...")
+        self.dataset = dataset
+        idcs = np.arange(len(dataset))
+        if getattr(dataset, 'imsize', None) is None or not hasattr(dataset, 'from_cache'):
+            self.imgs, self.labels = get_batch(dataset, idcs)
+            self.convert = None
+        else:
+            self.imgs = torch.from_numpy(np.array(dataset.get_cache()[dataset.get_index(idcs)]))
+            self.labels = dataset.complete_labels(dataset.get_label(idcs))
+            self.convert = dataset.from_cache
+        self.imgs = utils.cuda(self.imgs)
+        self.labels = utils.cuda(self.labels)
+        self.rng = rng.spawn()
+        self.generator = rng.torch_generator(self.labels.device)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def random_idcs(self, batch_size):
+        if getattr(self.dataset, 'label_sampler', None) is None:
+            return torch.randint(len(self), (batch_size,), device=self.labels.device, generator=self.generator)
+        return utils.cuda(torch.from_numpy(self.dataset.random_positions(batch_size, self.rng)))
+
+    def get_random_labelbatch(self, batch_size):
+        return self.labels[self.random_idcs(batch_size)]
+
+    def get_random_batch(self, batch_size):
+        idcs = self.random_idcs(batch_size)
+        imgs = self.imgs[idcs]
+        if not self.convert is None:
+            imgs = self.convert(imgs)
+        return imgs, self.labels[idcs]
+
+class DeviceCoupledDataset():
+    def __init__(self, dataset1, dataset2):
+        self.dataset1 = dataset1
+        self.dataset2 = dataset2
+
+    def get_random_labelbatch(self, batch_size):
+        return self.dataset1.get_random_labelbatch(batch_size), self.dataset2.get_random_labelbatch(batch_size)
+
+    def get_random_batch(self, batch_size):
+        im1, lab1 = self.dataset1.get_random_batch(batch_size)
+        im2, lab2 = self.dataset2.get_random_batch(batch_size)
+        return im1, im2, lab1, lab2
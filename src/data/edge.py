@@ -0,0 +1,80 @@
+import torch
+import torch.nn.functional as F
+
+# Batched versions of the edge domains of data/mnist.py. Both take uint8 images of shape (B, 1, H, W) on any device
+# and return uint8 images of the same shape.
+
+# Fixed point constants of cv2.Canny: tan(22.5 degrees) * 2**15 and the shift they are scaled with
+TG22 = 13573
+CANNY_SHIFT = 15
+
+SOBEL_X = [[-1, 0, 1],
+           [-2, 0, 2],
+           [-1, 0, 1]]
+
+def sobel(imgs):
+    kernel_x = imgs.new_tensor(SOBEL_X).view(1, 1, 3, 3)
+    kernel_y = kernel_x.transpose(2, 3)
+    padded = F.pad(imgs, (1, 1, 1, 1), mode='replicate')
+    return F.conv2d(padded, kernel_x), F.conv2d(padded, kernel_y)
+
+def shifted(t, dy, dx):
+    # t[..., i+dy, j+dx] at position (i, j), zero outside the image
+    h, w = t.size(2), t.size(3)
+    padded = F.pad(t, (1, 1, 1, 1))
+    return padded[:, :, 1+dy:1+dy+h, 1+dx:1+dx+w]
+
+def as_thresholds(threshold, imgs):
+    threshold = torch.as_tensor(threshold, dtype=torch.float32, device=imgs.device)
+    return threshold.floor().view(-1, 1, 1, 1)
+
+# Same output as cv2.Canny(img, low, high) with its default aperture of 3 and L1 gradient, applied to every image.
+# low and high are numbers or tensors with one threshold per image.
+def canny(imgs, low, high):
+    x = imgs.float()
+    low = as_thresholds(low, x)
+    high = as_thresholds(high, x)
+    low, high = torch.min(low, high), torch.max(low, high)
+
+    dx, dy = sobel(x)
+    mag = dx.abs() + dy.abs()
+
+    # non-maximum suppression along the quantized gradient direction, with the integer comparisons of OpenCV
+    ax = dx.abs().long()
+    ay = dy.abs().long() << CANNY_SHIFT
+    tg22x = ax * TG22
+    tg67x = tg22x + (ax << (CANNY_SHIFT + 1))
+    horizontal = ay < tg22x
+    vertical = ay > tg67x
+    s_pos = (dx < 0) == (dy < 0)
+
+    keep_h = (mag > shifted(mag, 0, -1)) & (mag >= shifted(mag, 0, 1))
+    keep_v = (mag > shifted(mag, -1, 0)) & (mag >= shifted(mag, 1, 0))
+    keep_d_pos = (mag > shifted(mag, -1, -1)) & (mag > shifted(mag, 1, 1))
+    keep_d_neg = (mag > shifted(mag, -1, 1)) & (mag > shifted(mag, 1, -1))
+    keep_d = torch.where(s_pos, keep_d_pos, keep_d_neg)
+    keep = torch.where(horizontal, keep_h, torch.where(vertical, keep_v, keep_d))
+
+    weak = keep & (mag > low)
+    strong = weak & (mag > high)
+
+    # hysteresis: grow the strong edges into 8-connected weak pixels until nothing changes
+    while True:
+        grown = weak & (F.max_pool2d(strong.float(), 3, stride=1, padding=1) > 0)
+        if torch.equal(grown, strong):
+            break
+        strong = grown
+    return strong.to(torch.uint8) * 255
+
+# Same output as cv2.dilate(img, np.ones((3, 3)), iterations=1) - img, applied to every image
+def diledge(imgs):
+    x = imgs.float()
+    dilation = F.max_pool2d(x, 3, stride=1, padding=1)
+    return (dilation - x).to(torch.uint8)
+
+def edges(imgs, img_type, low=0, high=0):
+    if img_type == 'edge':
+        return canny(imgs, low, high)
+    if img_type == 'diledge':
+        return diledge(imgs)
+    return imgs
@@ -0,0 +1,75 @@
+import os
+import hashlib
+import numpy as np
+
+from data import shared
+from data.sampler import AliasSampler
+
+# Groups the sample indices by label: label_dict[label] is the array of the indices of all samples with that label.
+# The dictionary is stored as numpy arrays together with a fingerprint of targets, and rebuilt when the targets change.
+def load_label_dict(filename, targets):
+    targets = np.asarray(targets).astype(np.int64)
+    fingerprint = hashlib.sha1(targets.tobytes()).hexdigest()
+    if os.path.exists(filename):
+        with np.load(filename) as f:
+            if str(f['fingerprint']) == fingerprint:
+                return dict(zip(f['labels'].tolist(), np.split(f['idcs'], f['offsets'][1:-1])))
+        print("Label dictionary " + filename + " does not match the dataset.")
+    return create_label_dict(filename, targets, fingerprint)
+
+def create_label_dict(filename, targets, fingerprint):
+    print("Creating label dictionary...")
+    idcs = np.argsort(targets, kind='stable')
+    labels, offsets = np.unique(targets[idcs], return_index=True)
+    offsets = np.append(offsets, len(idcs))
+
+    tmp_name = filename[:-len('.npz')] + '_tmp.npz'
+    np.savez(tmp_name, labels=labels, idcs=idcs, offsets=offsets, fingerprint=np.array(fingerprint))
+    os.replace(tmp_name, filename)
+    print("Label dictionary saved.")
+    return dict(zip(labels.tolist(), np.split(idcs, offsets[1:-1])))
+
+# Flat index over the samples of the selected labels, in the order in which the labels are given.
+# Position idx of the filtered dataset maps to sample idcs[idx] of the underlying dataset,
+# offsets holds the prefix sums of the per label counts and sample_labels the label at every position.
+# Both lookups accept a single position or an array of positions.
+class LabelIndex():
+    def __init__(self, label_dict, labels):
+        idcs = [np.asarray(label_dict.get(key, []), dtype=np.int64) for key in labels]
+        counts = [len(label_idcs) for label_idcs in idcs]
+        self.labels = np.array(labels, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.idcs = np.concatenate(idcs) if len(idcs) > 0 else np.zeros(0, dtype=np.int64)
+        self.sample_labels = np.repeat(self.labels, counts)
+
+    def __len__(self):
+        return len(self.idcs)
+
+    def __getstate__(self):
+        return shared.getstate(self, ['labels', 'offsets', 'idcs', 'sample_labels'])
+
+    def __setstate__(self, state):
+        shared.setstate(self, state)
+
+    def get_index(self, idx):
+        return self.idcs[idx]
+
+    def get_label(self, idx):
+        return self.sample_labels[idx]
+
+    # AliasSampler over self.labels that draws them with probabilities probs. Labels without samples are never drawn,
+    # the probabilities of the other labels are scaled up accordingly.
+    def label_sampler(self, probs):
+        probs = np.where(np.diff(self.offsets) > 0, np.asarray(probs, dtype=np.float64), 0.0)
+        if probs.sum() == 0:
+            raise RuntimeError("label probabilities: none of the labels with a nonzero probability has samples")
+        return AliasSampler(probs)
+
+    # Random positions, uniform over the samples, or with labels distributed according to sampler,
+    # an AliasSampler over self.labels from label_sampler, and uniform within each label
+    def random_positions(self, rng, size=None, sampler=None):
+        if sampler is None:
+            return rng.randint(len(self), size=size)
+        k = sampler.sample(rng, size)
+        counts = self.offsets[k+1] - self.offsets[k]
+        return self.offsets[k] + (rng.random_sample(size) * counts).astype(np.int64)
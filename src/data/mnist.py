@@ -1,15 +1,41 @@
 import torch
+import torch.nn.functional as F
 import cv2
 from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms, datasets
 import os   
-import pickle
 
 import numpy as np
 from PIL import Image
 
+from data import cache
+from data import shared
+from data.labelindex import LabelIndex, load_label_dict
+from data.rng import get_rng
+from data import edge
+from data.batch import Batch, stack
+
+def get_targets(dataset):
+    if hasattr(dataset, 'targets'):
+        return dataset.targets
+    if dataset.train:
+        return dataset.train_labels
+    return dataset.test_labels
+
+def get_data(dataset):
+    if hasattr(dataset, 'data'):
+        return dataset.data
+    if dataset.train:
+        return dataset.train_data
+    return dataset.test_data
+
+# If imsize is given, the processed images of the whole split are stored in a uint8 cache at that size
+# and transform is applied to the [0,1] float tensors read from it. Otherwise transform receives PIL images.
+# If edge_thresholds is given as well, the cache holds the original images at their native size instead, and the edge
+# domain is computed from them per batch with data/edge.py and resized afterwards. edge_thresholds is either [low, high]
+# or [low_min, low_max, high_min, high_max], in which case the Canny thresholds are drawn uniformly per image.
 class MNIST(Dataset) :
-    def __init__(self, labels, img_type='original', transform=None, root='../../../data/mnist', train=True, domain_val=None):
+    def __init__(self, labels, img_type='original', transform=None, root='../../../data/mnist', train=True, domain_val=None, imsize=None, edge_thresholds=None):
         if not len(set(labels)) == len(labels):
             raise RuntimeError("labels must not contain duplicates")
         self.domain_val = domain_val
@@ -17,65 +43,120 @@ class MNIST(Dataset) :
         self.dataset = datasets.MNIST(root=root, download=True, train=train)
         self.transform = transform
         self.img_type = img_type
+        self.imsize = imsize
+        self.edge_thresholds = edge_thresholds
+        self.cache = None
+
+        if not imsize is None:
+            self.cache_type, self.cache_size = img_type, imsize
+            if self.edges_on_the_fly():
+                self.cache_type, self.cache_size = 'original', self.dataset[0][0].size[0]
+            self.cache_file_name = os.path.join(root, 'cache_'+str(train)+'_'+self.cache_type+'_'+str(self.cache_size)+'.npy')
+            fingerprint = cache.fingerprint(np.asarray(get_data(self.dataset)), self.cache_type, self.cache_size)
+            shape = (self.cache_size, self.cache_size)
+            if not cache.matches(self.cache_file_name, fingerprint, len(self.dataset), shape):
+                cache.build(self.cache_file_name, len(self.dataset), shape, self.cache_sample, fingerprint)
         
-        label_file_name = os.path.join(root, 'labels_'+str(train)+'.pkl')
-        
-        if os.path.exists(label_file_name):
-            with open(label_file_name, "rb" ) as f:
-                self.label_dict = pickle.load(f)
-        else:
-            self.create_label_dict(label_file_name)
-
-        self.length = sum([len(self.label_dict[key]) for key in self.labels])
-
-    def create_label_dict(self, filename) :
-        print("Creating label dictionary...")
-        self.label_dict = {}
-        for it in range(10):
-            self.label_dict[it] = []
-        print("\r" + str(0) + '/' + str(self.dataset.__len__()), end='\r')
-        for idx in range(self.dataset.__len__()):
-            _, label = self.dataset.__getitem__(idx)
-            print("\r" + str(idx+1) + '/' + str(self.dataset.__len__()), end='\r')
-            self.label_dict[int(label)] += [idx]
-            
-        with open(filename, "wb" ) as f:
-            pickle.dump(self.label_dict, f)
-        print("Label dictionary saved.")
+        label_file_name = os.path.join(root, 'labels_'+str(train)+'.npz')
+        self.label_dict = load_label_dict(label_file_name, self.get_targets())
+
+        self.set_labels(labels)
+
+    # Re-filters the dataset in place to the given labels, without reloading the images or the label dictionary.
+    # Resets the label probabilities set with set_label_probs.
+    def set_labels(self, labels):
+        self.labels = labels
+        self.index = LabelIndex(self.label_dict, self.labels)
+        self.length = len(self.index)
+        self.label_sampler = None
 
     def __len__(self):
         return self.length
 
+    # The memory map is opened lazily, so that every DataLoader worker opens its own instead of receiving a pickled copy
+    def __getstate__(self):
+        state = shared.getstate(self, [])
+        state['cache'] = None
+        return state
+
+    def __setstate__(self, state):
+        shared.setstate(self, state)
+
+    def get_cache(self):
+        if self.cache is None:
+            self.cache = cache.load(self.cache_file_name)
+        return self.cache
+
+    def edges_on_the_fly(self):
+        return not self.edge_thresholds is None and self.img_type != 'original'
+
+    def random_thresholds(self, n, device):
+        if len(self.edge_thresholds) == 2:
+            return self.edge_thresholds
+        low_min, low_max, high_min, high_max = self.edge_thresholds
+        low = low_min + (low_max - low_min) * torch.rand(n, device=device)
+        high = high_min + (high_max - high_min) * torch.rand(n, device=device)
+        return low, high
+
+    # Turns uint8 images read from the cache, of shape (..., size, size), into transformed float images of shape (..., 1, imsize, imsize)
+    def from_cache(self, imgs):
+        if self.edges_on_the_fly():
+            shape = imgs.size()[:-2]
+            imgs = imgs.contiguous().view((-1, 1) + imgs.size()[-2:])
+            low, high = self.random_thresholds(len(imgs), imgs.device)
+            imgs = edge.edges(imgs, self.img_type, low, high).float().div_(255)
+            imgs = F.interpolate(imgs, size=(self.imsize, self.imsize), mode='bilinear', align_corners=False)
+            imgs = imgs.view(shape + (1, self.imsize, self.imsize))
+        else:
+            imgs = imgs.float().div_(255).unsqueeze(-3)
+        if self.transform:
+            imgs = self.transform(imgs)
+        return imgs
+
+    def cache_sample(self, idx):
+        img, _ = self.dataset[idx]
+        if self.cache_type != 'original':
+            img = self.process(img)
+        return np.array(img.resize((self.cache_size, self.cache_size), Image.BILINEAR))
+
+    def get_targets(self):
+        return get_targets(self.dataset)
+
+    # Labels are read from the label index, so no images are decoded
     def get_random_labelbatch(self, batch_size):
-        np.random.seed()
-        ys = []
-        for it in range(batch_size):
-            label = self.random_label()
-            label = [label.unsqueeze(0)]
-            ys += label
-        return torch.cat(ys, 0)
+        idcs = self.random_positions(batch_size)
+        return self.complete_labels(self.get_label(idcs))
 
     def random_label(self):
-        idx = np.random.randint(len(self))
-        idx2 = self.get_index(idx)
-        _, label = self.dataset[idx2]
-        return self.complete_label(label)
+        idx = self.random_positions()
+        return self.complete_label(self.get_label(idx))
 
     def complete_label(self, label):
         if self.domain_val is None:
-            return torch.LongTensor([label])
-        return torch.LongTensor([label, self.domain_val])
+            return torch.LongTensor([int(label)])
+        return torch.LongTensor([int(label), self.domain_val])
+
+    def complete_labels(self, labels):
+        labels = torch.from_numpy(labels).long().unsqueeze(1)
+        if self.domain_val is None:
+            return labels
+        domain_vals = torch.LongTensor(len(labels), 1).fill_(self.domain_val)
+        return torch.cat([labels, domain_vals], 1)
+
+    # probs maps every label of the dataset to the probability with which random_positions draws it
+    def set_label_probs(self, probs):
+        self.label_sampler = self.index.label_sampler([probs[label] for label in self.labels])
+
+    def random_positions(self, size=None, rng=None):
+        return self.index.random_positions(get_rng() if rng is None else rng, size, self.label_sampler)
 
     def get_index(self, idx):
-        for key in self.labels:
-            listlen = len(self.label_dict[key])
-            if idx < listlen:
-                return self.label_dict[key][idx]
-            idx -= listlen
+        return self.index.get_index(idx)
 
-    def __getitem__(self, idx):
-        idx2 = self.get_index(idx)
-        img, label = self.dataset[idx2]
+    def get_label(self, idx):
+        return self.index.get_label(idx)
+
+    def process(self, img):
         if self.img_type != 'original':
             img_np = np.array(img)
             if self.img_type == 'edge':
@@ -84,8 +165,24 @@ class MNIST(Dataset) :
                 dilation = cv2.dilate(img_np, np.ones((3, 3), np.uint8), iterations=1)
                 edge_np = dilation - img
             img = Image.fromarray(edge_np)
-        
-        if self.transform:
-            img = self.transform(img)
+        return img
+
+    def __getitem__(self, idx):
+        idx2 = self.get_index(idx)
+        if self.imsize is None:
+            img, label = self.dataset[idx2]
+            img = self.process(img)
+            if self.transform:
+                img = self.transform(img)
+        else:
+            img = self.from_cache(torch.from_numpy(np.array(self.get_cache()[idx2])))
+            label = int(self.get_targets()[idx2])
         
         return img, self.complete_label(label)
+
+    def __getitems__(self, idcs):
+        idcs = np.asarray(idcs, dtype=np.int64)
+        if self.imsize is None:
+            return stack([self[idx] for idx in idcs])
+        imgs = self.from_cache(torch.from_numpy(np.array(self.get_cache()[self.get_index(idcs)])))
+        return Batch((imgs, self.complete_labels(self.get_label(idcs))))
@@ -0,0 +1,58 @@
+import threading
+from contextlib import contextmanager
+import numpy as np
+import torch
+
+# Generator for all random index and label draws made by the datasets.
+# Every process draws from its own generator. The main process seeds it with seed(), or from OS entropy if seed() is
+# never called. A DataLoader worker seeds its generator on first use from the seed torch gives that worker, which is
+# derived from the torch seed of the main process. Setting torch.manual_seed therefore makes the worker streams reproducible.
+_rng = None
+_worker_id = None
+_local = threading.local()
+
+def seed(s=None):
+    global _rng, _worker_id
+    _rng = np.random.RandomState(s)
+    _worker_id = current_worker_id()
+
+def current_worker_id():
+    info = torch.utils.data.get_worker_info()
+    if info is None:
+        return None
+    return info.id
+
+def get_rng():
+    seeded = getattr(_local, 'rng', None)
+    if not seeded is None:
+        return seeded
+    worker_id = current_worker_id()
+    if _rng is None or worker_id != _worker_id:
+        if worker_id is None:
+            seed()
+        else:
+            seed(torch.utils.data.get_worker_info().seed % 2**32)
+    return _rng
+
+# Within the context, get_rng returns a generator seeded with s on this thread. Loaders that run dataset code on a pool
+# of threads seed every sample, so that its draws do not depend on the thread that loads it or on the timing of the others.
+@contextmanager
+def seeded(s):
+    if getattr(_local, 'seeded', None) is None:
+        _local.seeded = np.random.RandomState()
+    _local.seeded.seed(s)
+    _local.rng = _local.seeded
+    try:
+        yield
+    finally:
+        _local.rng = None
+
+# Generators of their own, for draws made on another thread than the training loop, such as the prefetch thread.
+# They are seeded from get_rng when they are created, so seed() makes them reproducible as well.
+def spawn():
+    return np.random.RandomState(get_rng().randint(2**32, dtype=np.int64))
+
+def torch_generator(device='cpu'):
+    generator = torch.Generator(device=device)
+    generator.manual_seed(int(get_rng().randint(2**62, dtype=np.int64)))
+    return generator
@@ -0,0 +1,57 @@
+import numpy as np
+
+# Walker's alias method: after an O(n) setup, every draw from the discrete distribution probs costs O(1).
+class AliasSampler():
+    def __init__(self, probs):
+        probs = np.asarray(probs, dtype=np.float64)
+        n = len(probs)
+        scaled = probs * n / probs.sum()
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while len(small) > 0 and len(large) > 0:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small += [l]
+            else:
+                large += [l]
+
+    # Returns indices into probs, a single one if size is None
+    def sample(self, rng, size=None):
+        idcs = rng.randint(len(self.prob), size=size)
+        accept = rng.random_sample(size) < self.prob[idcs]
+        return np.where(accept, idcs, self.alias[idcs])
+
+def uniform_probs(labels):
+    probs = {}
+    for label in labels:
+        probs[label] = 1.0/len(labels)
+    return probs
+
+# Label probabilities for two domains such that, summed over both domains, every label in either domain is drawn equally often.
+# Labels that occur in only one domain get 2/|labels1 ∪ labels2| in that domain, the rest of its mass is spread uniformly
+# over the labels it shares with the other domain. If a domain has too many labels of its own for that to be possible,
+# its own labels are drawn uniformly and its shared labels get no mass.
+def balanced_probs(labels1, labels2):
+    union = set(labels1) | set(labels2)
+    shared = [label for label in labels1 if label in labels2]
+    target = 2.0/len(union)
+    return domain_probs(labels1, shared, target), domain_probs(labels2, shared, target)
+
+def domain_probs(labels, shared, target):
+    own = [label for label in labels if not label in shared]
+    if len(own) == 0 or len(shared) == 0:
+        return uniform_probs(labels)
+    own_p = min(target, 1.0/len(own))
+    shared_p = (1.0 - own_p*len(own))/len(shared)
+
+    probs = {}
+    for label in labels:
+        probs[label] = own_p if label in own else shared_p
+    return probs
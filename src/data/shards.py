@@ -0,0 +1,163 @@
+import os
+import io
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+from PIL import Image
+
+from data.celeba import load_attributes, data_folder, load_images, select_rows, decode_scaled, crop_and_scale, to_tensor
+from data.rng import get_rng
+
+# CelebA packed into a few large files, for storage on which reading many small files is slow.
+# Every shard_<n>.bin holds the JPEG files of shard_size consecutive attribute rows, concatenated.
+# index.npz holds for every row its shard, the offset and size of its JPEG in that shard, and the attributes,
+# so the attribute file and the image directory are not needed to read the shards.
+def shard_name(folder, shard):
+    return os.path.join(folder, 'shard_%05d.bin' % shard)
+
+def build_shards(root, folder, shard_size):
+    all_labelnames, filenames, attrs = load_attributes(data_folder(root))
+    images = load_images(root, filenames)
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+
+    print("Creating shards in " + folder + "...")
+    shards = np.arange(len(images)) // shard_size
+    offsets = np.zeros(len(images), dtype=np.int64)
+    sizes = np.zeros(len(images), dtype=np.int64)
+    for shard in range(shards[-1] + 1 if len(images) > 0 else 0):
+        rows = np.nonzero(shards == shard)[0]
+        tmp_name = shard_name(folder, shard) + '.tmp'
+        with open(tmp_name, 'wb') as out:
+            for row in rows:
+                with images.open(row) as f:
+                    data = f.read()
+                offsets[row] = out.tell()
+                sizes[row] = len(data)
+                out.write(data)
+        os.replace(tmp_name, shard_name(folder, shard))
+        print("\r" + str(rows[-1]+1) + '/' + str(len(images)), end='\r')
+
+    tmp_name = os.path.join(folder, 'index_tmp.npz')
+    np.savez(tmp_name, names=np.array(all_labelnames), filenames=filenames, attrs=attrs,
+             shards=shards, offsets=offsets, sizes=sizes)
+    os.replace(tmp_name, os.path.join(folder, 'index.npz'))
+    print("Shards saved.")
+
+# Streams the samples of CelebA_dataset from shards, reading every shard with one sequential read.
+# The order is shuffled at two levels: the shards are read in random order, and the samples pass through a buffer
+# of buffer_size samples from which they are drawn at random. DataLoader workers each read their own subset of the shards.
+# One iteration is one pass over the selected images. Use with DataLoader(..., batch_size=mini_batch_size).
+class CelebA_shards(IterableDataset):
+    def __init__(self, labelnames=["Male"], pos_labels=[], neg_labels=[], domain_label=None, domain_val=None, folder='../data/celeba_shards/', transform=None, cropsize=None, imsize=None, buffer_size=1000):
+        self.folder = folder
+        self.transform = transform
+        self.cropsize = cropsize
+        self.imsize = imsize
+        self.buffer_size = buffer_size
+        self.labelnames = labelnames
+        self.neg_labels = neg_labels
+        self.domain_label = domain_label
+        self.domain_val = domain_val
+        with np.load(os.path.join(folder, 'index.npz')) as f:
+            self.all_labelnames = list(f['names'])
+            self.attrs = f['attrs']
+            self.shards, self.offsets, self.sizes = f['shards'], f['offsets'], f['sizes']
+        self.set_labels(pos_labels)
+
+    def set_labels(self, pos_labels, neg_labels=None):
+        if not neg_labels is None:
+            self.neg_labels = neg_labels
+        # selected rows and their labels in row order
+        self.rows, self.label_array = select_rows(self.all_labelnames, self.attrs, self.labelnames,
+            pos_labels, self.neg_labels, self.domain_label, self.domain_val)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_random_labelbatch(self, batch_size):
+        idcs = get_rng().randint(len(self), size=batch_size)
+        return torch.from_numpy(self.label_array[idcs])
+
+    def decode(self, data):
+        img = Image.open(io.BytesIO(data))
+        if self.imsize is None:
+            img = img.convert('RGB')
+        else:
+            img, size = decode_scaled(img, self.cropsize, self.imsize)
+            img = to_tensor(crop_and_scale(img, self.cropsize, self.imsize, size))
+        if self.transform:
+            img = self.transform(img)
+        return img
+
+    # Positions of the selected images per shard of this worker, shards in random order
+    def worker_shards(self):
+        # rows are sorted, so the positions of each shard are consecutive
+        _, starts = np.unique(self.shards[self.rows], return_index=True)
+        groups = np.split(np.arange(len(self.rows)), starts[1:]) if len(self.rows) > 0 else []
+        info = get_worker_info()
+        if not info is None:
+            groups = groups[info.id::info.num_workers]
+        return [groups[idx] for idx in get_rng().permutation(len(groups))]
+
+    def samples(self):
+        for positions in self.worker_shards():
+            rows = self.rows[positions]
+            with open(shard_name(self.folder, self.shards[rows[0]]), 'rb') as f:
+                data = f.read()
+            for pos, row in zip(positions, rows):
+                img = self.decode(data[self.offsets[row]:self.offsets[row] + self.sizes[row]])
+                yield img, torch.from_numpy(self.label_array[pos])
+
+    def __iter__(self):
+        rng = get_rng()
+        buf = []
+        for sample in self.samples():
+            if len(buf) < self.buffer_size:
+                buf.append(sample)
+                continue
+            idx = rng.randint(len(buf))
+            yield buf[idx]
+            buf[idx] = sample
+        rng.shuffle(buf)
+        for sample in buf:
+            yield sample
+
+# Pairs the samples of two streams, which are restarted whenever they run out, like CoupledDataset does for
+# random access datasets. One iteration gives config.batches batches of pairs, divided over the DataLoader workers.
+class CoupledStream(IterableDataset):
+    def __init__(self, config, stream1, stream2):
+        self.config = config
+        self.dataset1 = stream1
+        self.dataset2 = stream2
+
+    def __len__(self):
+        return self.config.batches * self.config.mini_batch_size
+
+    def get_random_labelbatch(self, batchsize):
+        return self.dataset1.get_random_labelbatch(batchsize), self.dataset2.get_random_labelbatch(batchsize)
+
+    def set_labels(self, labels1, labels2):
+        self.dataset1.set_labels(labels1)
+        self.dataset2.set_labels(labels2)
+
+    def __iter__(self):
+        steps = self.config.batches
+        info = get_worker_info()
+        if not info is None:
+            steps = steps // info.num_workers + (1 if info.id < steps % info.num_workers else 0)
+        samples1 = repeat(self.dataset1)
+        samples2 = repeat(self.dataset2)
+        for it in range(steps * self.config.mini_batch_size):
+            im1, lab1 = next(samples1)
+            im2, lab2 = next(samples2)
+            yield im1, im2, lab1, lab2
+
+def repeat(stream):
+    while True:
+        empty = True
+        for sample in stream:
+            empty = False
+            yield sample
+        if empty:
+            raise RuntimeError('stream has no samples, are there fewer shards than DataLoader workers?')
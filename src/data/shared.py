@@ -0,0 +1,44 @@
+import numpy as np
+import torch
+
+# Per-sample metadata of the datasets (indices, labels, attributes, file names) is kept in flat numpy arrays instead of
+# Python lists and dicts. Forked DataLoader workers then share these pages with the main process, because there are no
+# per-sample objects whose reference counts trigger copy-on-write.
+# Workers that are spawned instead of forked receive a pickled copy of the dataset. After enable(), the arrays named by
+# a dataset are moved to shared memory once and pickled as handles to it, so all workers map the same memory.
+_enabled = False
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+class SharedArray():
+    def __init__(self, arr):
+        arr = np.ascontiguousarray(arr)
+        self.dtype = arr.dtype.str
+        self.shape = arr.shape
+        self.tensor = torch.from_numpy(arr.reshape(-1).view(np.uint8)).clone().share_memory_()
+
+    def array(self):
+        return self.tensor.numpy().view(np.dtype(self.dtype)).reshape(self.shape)
+
+# State of obj for pickling, with the arrays in names replaced by SharedArrays.
+# The shared copies are kept in obj.shared_arrays and reused as long as the attribute still holds the same array.
+def getstate(obj, names):
+    state = obj.__dict__.copy()
+    state.pop('shared_arrays', None)
+    if not _enabled:
+        return state
+    shared_arrays = obj.__dict__.setdefault('shared_arrays', {})
+    for name in names:
+        arr = state[name]
+        if not name in shared_arrays or not shared_arrays[name][0] is arr:
+            shared_arrays[name] = (arr, SharedArray(arr))
+        state[name] = shared_arrays[name][1]
+    return state
+
+def setstate(obj, state):
+    for name, value in state.items():
+        if isinstance(value, SharedArray):
+            state[name] = value.array()
+    obj.__dict__.update(state)
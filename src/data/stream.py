@@ -0,0 +1,22 @@
+from torch.utils.data import IterableDataset, get_worker_info
+
+# Streams random batches of a dataset that implements get_random_batch, such as CoupledDataset.
+# An epoch consists of steps batches, which are divided over the DataLoader workers. Every worker draws its batches
+# with its own generator, so no index permutation is built or sent to the workers.
+# Use with DataLoader(..., batch_size=None), since the batches are already collated.
+class BatchStream(IterableDataset):
+    def __init__(self, dataset, batch_size, steps):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.steps = steps
+
+    def __len__(self):
+        return self.steps
+
+    def __iter__(self):
+        steps = self.steps
+        info = get_worker_info()
+        if not info is None:
+            steps = steps // info.num_workers + (1 if info.id < steps % info.num_workers else 0)
+        for it in range(steps):
+            yield self.dataset.get_random_batch(self.batch_size)
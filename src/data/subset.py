@@ -1,6 +1,8 @@
 from torch.utils.data import Dataset
 from torchvision import datasets
 
+from data.batch import get_batch
+
 class Subset(Dataset) :
     def __init__(self, dset, idcs):
         self.dset = dset
@@ -15,4 +17,7 @@ class Subset(Dataset) :
 
     def __getitem__(self, idx):
         idx2 = self.idcs[idx]
-        return self.dset[idx2]
\ No newline at end of file
+        return self.dset[idx2]
+
+    def __getitems__(self, idcs):
+        return get_batch(self.dset, [self.idcs[idx] for idx in idcs])
\ No newline at end of file
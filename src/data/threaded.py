@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+
+from data import rng
+
+# In-process alternative to a DataLoader with worker processes, for datasets whose loading is dominated by work that
+# releases the GIL, such as JPEG decoding and PIL resizing. Samples are loaded with dataset[idx] on a pool of threads
+# that all share the one copy of the dataset, and every thread copies its sample straight into the tensors of its batch.
+# Iterating gives one shuffled epoch of batches as lists of tensors, like a DataLoader with shuffle=True.
+# Without shuffle the indices are used in order, for datasets like CoupledDataset that draw random samples themselves.
+# depth batches are loaded ahead of the one that is consumed. close() stops the threads.
+# The order and a seed for every sample are drawn from a generator of the loader, see rng.seeded.
+class ThreadedLoader():
+    def __init__(self, dataset, batch_size, threads, depth=2, shuffle=True):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.depth = depth
+        self.shuffle = shuffle
+        self.rng = rng.spawn()
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def submit(self, idcs):
+        buf = BatchBuffer(len(idcs))
+        seeds = self.rng.randint(2**32, size=len(idcs), dtype=np.int64)
+        futures = [self.executor.submit(buf.load, self.dataset, pos, idx, seed)
+                   for pos, (idx, seed) in enumerate(zip(idcs, seeds))]
+        return buf, futures
+
+    def batch(self, order, it):
+        idcs = range(it*self.batch_size, min((it+1)*self.batch_size, len(self.dataset)))
+        if order is None:
+            return idcs
+        return order[idcs.start:idcs.stop]
+
+    def __iter__(self):
+        order = self.rng.permutation(len(self.dataset)) if self.shuffle else None
+        pending = [self.submit(self.batch(order, it)) for it in range(min(self.depth, len(self)))]
+        for it in range(len(self)):
+            buf, futures = pending.pop(0)
+            if it + self.depth < len(self):
+                pending.append(self.submit(self.batch(order, it + self.depth)))
+            for future in futures:
+                future.result()
+            yield buf.fields
+
+# The tensors of one batch. They are allocated by the first sample that is loaded, from the sizes and types of its fields.
+class BatchBuffer():
+    def __init__(self, size):
+        self.size = size
+        self.fields = None
+        self.lock = threading.Lock()
+
+    def load(self, dataset, pos, idx, seed):
+        with rng.seeded(seed):
+            sample = dataset[int(idx)]
+        if self.fields is None:
+            with self.lock:
+                if self.fields is None:
+                    self.fields = [torch.empty((self.size,) + tuple(x.size()), dtype=x.dtype) for x in sample]
+        for field, x in zip(self.fields, sample):
+            field[pos].copy_(x)
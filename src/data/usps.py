@@ -10,6 +10,13 @@ import torch.utils.data as data
 import torch
 import urllib
 
+from torch.utils.data.dataloader import default_collate
+
+from data import shared
+from data.labelindex import LabelIndex, load_label_dict
+from data.batch import Batch
+from data.rng import get_rng
+
 
 class USPS(data.Dataset):
     # Num of Train = 7438, Num ot Test 1860
@@ -25,51 +32,64 @@ class USPS(data.Dataset):
         self.img_data *= 255.0
         self.img_data = self.img_data.transpose((0, 2, 3, 1))  # convert to HWC
 
-        label_file_name = os.path.join(root, 'labels_'+str(train)+'.pkl')
-        
-        if os.path.exists(label_file_name):
-            with open(label_file_name, "rb" ) as f:
-                self.label_dict = pickle.load(f)
-        else:
-            self.create_label_dict(label_file_name)
-
-        self.length = sum([len(self.label_dict[key]) for key in self.labels])
-
-    def create_label_dict(self, filename) :
-        print("Creating label dictionary...")
-        self.label_dict = {}
-        for it in range(10):
-            self.label_dict[it] = []
-        print("\r" + str(0) + '/' + str(len(self.img_data)), end='\r')
-        for idx in range(len(self.img_data)):
-            _, label = self.img_data[idx, ::], self.img_labels[idx]
-            print("\r" + str(idx+1) + '/' + str(len(self.img_data)), end='\r')
-            self.label_dict[label] += [idx]
-            
-        with open(filename, "wb" ) as f:
-            pickle.dump(self.label_dict, f)
-        print("Label dictionary saved.")
+        label_file_name = os.path.join(root, 'labels_'+str(train)+'.npz')
+        self.label_dict = load_label_dict(label_file_name, self.img_labels)
+
+        self.set_labels(labels)
+
+    # Re-filters the dataset in place to the given labels, without reloading the images or the label dictionary.
+    # Resets the label probabilities set with set_label_probs.
+    def set_labels(self, labels):
+        self.labels = labels
+        self.index = LabelIndex(self.label_dict, self.labels)
+        self.length = len(self.index)
+        self.label_sampler = None
+
+    def get_random_labelbatch(self, batch_size):
+        idcs = self.random_positions(batch_size)
+        return torch.from_numpy(self.get_label(idcs)).long().unsqueeze(1)
+
+    # probs maps every label of the dataset to the probability with which random_positions draws it
+    def set_label_probs(self, probs):
+        self.label_sampler = self.index.label_sampler([probs[label] for label in self.labels])
+
+    def random_positions(self, size=None, rng=None):
+        return self.index.random_positions(get_rng() if rng is None else rng, size, self.label_sampler)
 
     def get_index(self, idx):
-        for key in self.labels:
-            listlen = len(self.label_dict[key])
-            if idx < listlen:
-                return self.label_dict[key][idx]
-            idx -= listlen
+        return self.index.get_index(idx)
 
-    def __getitem__(self, idx):
-        idx2 = self.get_index(idx)
-        img, label = self.img_data[idx2, ::], self.img_labels[idx2]
+    def get_label(self, idx):
+        return self.index.get_label(idx)
+
+    def get_img(self, idx2):
+        img = self.img_data[idx2, ::]
         img = np.array(img).reshape((28,28)).astype(np.uint8)
         img = Image.fromarray(img)
         if self.transform is not None:
             img = self.transform(img)
-        label = torch.LongTensor([int(label)])
-        return img, label
+        return img
+
+    def __getitem__(self, idx):
+        idx2 = self.get_index(idx)
+        label = torch.LongTensor([int(self.img_labels[idx2])])
+        return self.get_img(idx2), label
+
+    def __getitems__(self, idcs):
+        idcs = np.asarray(idcs, dtype=np.int64)
+        imgs = default_collate([self.get_img(idx2) for idx2 in self.get_index(idcs)])
+        labels = torch.from_numpy(self.get_label(idcs)).long().unsqueeze(1)
+        return Batch((imgs, labels))
 
     def __len__(self):
         return self.length
 
+    def __getstate__(self):
+        return shared.getstate(self, ['img_data', 'img_labels'])
+
+    def __setstate__(self, state):
+        shared.setstate(self, state)
+
     def download(self):
         filename = os.path.join(self.root, self.filename)
         dirname = os.path.dirname(filename)
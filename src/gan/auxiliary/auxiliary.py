@@ -1,4 +1,8 @@
+import numpy as np
 import torch
+from torch.autograd import Variable
+
+import utils
 
 def rescale(t):
     t.div_(0.5).add_(-1)
@@ -20,3 +24,48 @@ def to_one_hot(categories, y):
         idcs = y[:,it].unsqueeze(1) + sum(categories[:it])
         onehot.scatter_(1, idcs, 1)
     return onehot
+
+#Builds the conditional generator input for batches of class vectors, on the device of the models.
+#Class vectors with several categories are encoded into one multi-hot vector: the ones are scattered at the class of
+#every category plus the offset of that category. CelebA attribute vectors (labeltype bool) are copied as floats.
+#The encodings are written into buffers that are allocated once. There are slots sets of them, which are used in turn,
+#so an encoding is overwritten by the slots-th encoding after it.
+class ConditionEncoder():
+    def __init__(self, config, slots=1):
+        self.enabled = config.auxclas or config.conditional
+        self.onehot = config.dataname != "CelebA" or config.labeltype == 'onehot'
+        self.domains = 2 if config.coupled else 1
+        self.width = sum(config.categories)
+        self.offsets = utils.cuda(torch.LongTensor(np.cumsum([0] + config.categories[:-1])).unsqueeze(0))
+        self.buffers = [{} for _ in range(slots)]
+        self.slot = 0
+
+    def buffer(self, slot, name, size, dtype, device):
+        buf = self.buffers[slot].get(name)
+        if buf is None or buf.size() != size or buf.dtype != dtype or buf.device != device:
+            buf = torch.empty(size, dtype=dtype, device=device)
+            self.buffers[slot][name] = buf
+        return buf
+
+    #Takes the class vectors of every domain and returns the conditional input for the generator
+    def __call__(self, *cs):
+        if not self.enabled:
+            return ()
+        slot = self.slot
+        self.slot = (self.slot + 1) % len(self.buffers)
+
+        g_inp = ()
+        for idx in range(self.domains):
+            c = utils.cuda_async(cs[idx].data)
+            if self.onehot:
+                if len(c.size()) == 1:
+                    c = c.unsqueeze(1)
+                idcs = self.buffer(slot, ('idcs', idx), c.size(), torch.long, c.device)
+                torch.add(c.long(), self.offsets, out=idcs)
+                out = self.buffer(slot, ('out', idx), torch.Size((c.size(0), self.width)), torch.float, c.device)
+                out.zero_().scatter_(1, idcs, 1)
+            else:
+                out = self.buffer(slot, ('out', idx), c.size(), torch.float, c.device)
+                out.copy_(c)
+            g_inp += (Variable(out),)
+        return g_inp
@@ -48,7 +48,7 @@ class GAN():
         self.D.load_state_dict(dstate)
     
     def get_celeba_dataset(self, pos_labels, neg_labels, domain_label=None, domain_val=None):
-        return CelebA_dataset(root='../data/celeba/', 
+        return CelebA_dataset(root=self.config.celeba_root, 
               labelnames=self.config.labelnames, pos_labels=pos_labels, neg_labels=neg_labels, 
               domain_label=domain_label, domain_val=domain_val,
               transform=transforms.Compose([transforms.CenterCrop(160),
@@ -1,38 +1,71 @@
 import os
 import pickle
 import copy
+import numpy as np
+import torch
 
+# The errors are first written to a buffer on the device of the models, with one row per call of store_errors and
+# one column per error. Storing them then does not wait for the device. The rows are copied to the host in bulk when
+# the buffer is full, or when the errors are read or saved. On the host every error is a float32 numpy array.
 class ErrorStorage(): 
-    def __init__(self, config):
+    def __init__(self, config, buffer_size=1024):
         self.config = config
+        self.buffer_size = buffer_size
         self.error_dicts = [{}]
         if self.config.coupled:
             self.error_dicts += [{}]
         for error_dict in self.error_dicts:
             self.init_error_dict(error_dict)
+        self.buffers = {}
+        self.counts = {}
 
     def init_error_dict(self, d):
         d['G'] = {}
-        d['G']['source'] = []
+        d['G']['source'] = np.zeros(0, dtype=np.float32)
         
         d['D'] = {}
         d['D']['err1'] = {}
         d['D']['err2'] = {}
-        d['D']['err1']['source'] = []
-        d['D']['err2']['source'] = []        
+        d['D']['err1']['source'] = np.zeros(0, dtype=np.float32)
+        d['D']['err2']['source'] = np.zeros(0, dtype=np.float32)
 
         if self.config.auxclas:
-            d['G']['classification'] = []
-            d['D']['err1']['classification'] = []
-            d['D']['err2']['classification'] = []
-            
+            d['G']['classification'] = np.zeros(0, dtype=np.float32)
+            d['D']['err1']['classification'] = np.zeros(0, dtype=np.float32)
+            d['D']['err2']['classification'] = np.zeros(0, dtype=np.float32)
+
+    # The error dict entries of the columns of the buffer of model
+    def columns(self, idx, model):
+        d = self.error_dicts[idx][model]
+        if model == 'D':
+            keys = [(d['err1'], 'source'), (d['err2'], 'source')]
+            if self.config.auxclas:
+                keys += [(d['err1'], 'classification'), (d['err2'], 'classification')]
+        else:
+            keys = [(d, 'source')]
+            if self.config.auxclas:
+                keys += [(d, 'classification')]
+        return keys
+
+    # Copies the buffered errors to the error dicts
+    def flush(self):
+        for (idx, model), count in self.counts.items():
+            if count == 0:
+                continue
+            rows = self.buffers[(idx, model)][:count].cpu().numpy()
+            for col, (d, key) in enumerate(self.columns(idx, model)):
+                d[key] = np.concatenate([d[key], rows[:, col]])
+            self.counts[(idx, model)] = 0
+
     def get_error_dicts(self):
+        self.flush()
         error_dicts = []
         for error_dict in self.error_dicts:
             error_dicts += [copy.deepcopy(error_dict)]
         return error_dicts
 
     def save_error(self):
+        self.flush()
         filename = os.path.join(self.config.savefolder, 'error.pkl')
         with open(filename, 'wb') as f:
             pickle.dump(self.error_dicts, f)
@@ -40,24 +73,30 @@ class ErrorStorage():
     def load_error(self):
         filename = os.path.join(self.config.loadfolder, 'error.pkl')
         with open(filename, 'rb') as f:
-            self.self.error_dicts = pickle.load(f)
-
-    def savable(self, error):
-        return error.data.cpu().numpy()
+            self.error_dicts = [to_arrays(error_dict) for error_dict in pickle.load(f)]
+        self.counts = {key: 0 for key in self.buffers}
 
     def store_errors(self, model, idx, src_error, class_error=None):
-        error_list_fake = self.error_dicts[idx][model]
-        d = self.error_dicts[idx][model]
         if model == 'D':
-            d['err1']['source'] += [self.savable(src_error[0])]
-            d['err2']['source'] += [self.savable(src_error[1])]
+            errors = [src_error[0], src_error[1]]
+            if self.config.auxclas:
+                errors += [class_error[0], class_error[1]]
         else:
-            d['source'] += [self.savable(src_error)]
+            errors = [src_error]
+            if self.config.auxclas:
+                errors += [class_error]
 
-        if self.config.auxclas:
-            if model == 'D':
-                d['err1']['classification'] += [self.savable(class_error[0])]
-                d['err2']['classification'] += [self.savable(class_error[1])]
-            else:
-                self.error_dicts[idx][model]['classification'] += [self.savable(src_error)]
-            
\ No newline at end of file
+        key = (idx, model)
+        if not key in self.buffers:
+            self.buffers[key] = torch.empty(self.buffer_size, len(errors), device=errors[0].device)
+            self.counts[key] = 0
+        torch.stack([error.detach().view(()) for error in errors], out=self.buffers[key][self.counts[key]])
+        self.counts[key] += 1
+        if self.counts[key] == self.buffer_size:
+            self.flush()
+
+# Error dicts saved by earlier versions hold lists of numpy scalars
+def to_arrays(d):
+    if isinstance(d, dict):
+        return {key: to_arrays(value) for key, value in d.items()}
+    return np.asarray(d, dtype=np.float32).reshape(-1)
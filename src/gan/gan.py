@@ -1,13 +1,21 @@
 import sys
 import os
 import torch.nn.functional as F
+from torch.utils.data import IterableDataset
 
 
 from data.coupled import *
 from data.combined import *
+from data.stream import BatchStream
+from data.threaded import ThreadedLoader
+from data.shards import CelebA_shards, CoupledStream
+from data import batch as databatch
+from data.device import DeviceDataset, DeviceCoupledDataset
 from data.mnist import *
 from data.usps import *
 from data.celeba import *
+from data import rng
+from data import shared
 
 from vis.visualizer import *
 from vis import errorplot
@@ -16,15 +24,24 @@ from gan.trainer import *
 from gan.auxiliary.auxiliary import rescale
 import utils
 
-from gan.auxiliary.sample import sample_c
+from gan.prefetch import Prefetcher, steps
 
 class GAN():
     def __init__(self, config):
         self.config = config
+        if not config.seed is None:
+            torch.manual_seed(config.seed)
+            rng.seed(config.seed)
+        shared.enable(config.shared_metadata)
         self.init_generator()
         self.init_discriminator()
-        if not os.path.exists(config.savefolder):
-            os.mkdir(config.savefolder)
+        self.make_savefolder()
+        self.dataset = None
+        self.dataloader = None
+
+    def make_savefolder(self):
+        if not os.path.exists(self.config.savefolder):
+            os.mkdir(self.config.savefolder)
 
     def init_generator(self):
         module_name = "gan.model.generator." + self.config.generator
@@ -57,23 +74,28 @@ class GAN():
         self.D.load_state_dict(dstate)
     
     def get_celeba_dataset(self, pos_labels, neg_labels, domain_label=None, domain_val=None):
-        return CelebA_dataset(root='../data/celeba/', 
+        if not self.config.celeba_shards is None:
+            return CelebA_shards(folder=self.config.celeba_shards,
+                  labelnames=self.config.labelnames, pos_labels=pos_labels, neg_labels=neg_labels,
+                  domain_label=domain_label, domain_val=domain_val,
+                  transform=transforms.Normalize(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5)),
+                  cropsize=self.config.cropsize,
+                  imsize=self.config.imsize)
+        return CelebA_dataset(root=self.config.celeba_root, 
               labelnames=self.config.labelnames, pos_labels=pos_labels, neg_labels=neg_labels, 
               domain_label=domain_label, domain_val=domain_val,
-              transform=transforms.Compose([transforms.CenterCrop(self.config.cropsize),
-                                            transforms.Scale((self.config.imsize,self.config.imsize)),
-                                            transforms.ToTensor(),
-                                            transforms.Normalize(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5))]),
-              labeltype=self.config.labeltype)
+              transform=transforms.Normalize(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5)),
+              labeltype=self.config.labeltype,
+              cropsize=self.config.cropsize,
+              imsize=self.config.imsize)
 
     def get_mnist_dataset(self, labels, img_type, domain_val):
-        return MNIST(labels, img_type, transform=transforms.Compose([
-                                        transforms.Scale((self.config.imsize,self.config.imsize)),
-                                        transforms.ToTensor(),
-                                        transforms.Lambda(rescale)]),
+        return MNIST(labels, img_type, transform=transforms.Lambda(rescale),
                      root='../data/mnist/',
                      train=self.config.train,
-                     domain_val=domain_val)
+                     domain_val=domain_val,
+                     imsize=self.config.imsize,
+                     edge_thresholds=self.config.edge_thresholds)
 
     def get_usps_dataset(self, labels):
         return USPS(labels, transform=transforms.Compose([
@@ -107,8 +129,12 @@ class GAN():
                 dataset1 = self.get_digit_dataset(self.config.labels1, self.config.dataname, 0)
                 dataset2 = self.get_digit_dataset(self.config.labels2, self.config.dataname2,1)
             
-            if self.config.coupled:
+            if self.config.coupled and isinstance(dataset1, IterableDataset):
+                dataset = CoupledStream(self.config, dataset1, dataset2)
+            elif self.config.coupled:
                 dataset = CoupledDataset(self.config, dataset1, dataset2)
+            elif isinstance(dataset1, IterableDataset):
+                raise RuntimeError("celeba_shards: only implemented for single and coupled datasets")
             else:
                 dataset = CombinedDataset(dataset1, dataset2)
 
@@ -137,31 +163,112 @@ class GAN():
 
 
 
+    # Arguments of the DataLoaders for their workers.
+    # The loaders draw their order and worker seeds from generators of their own. With prefetching the loader runs on
+    # the prefetch thread, and draws from the global torch generator would depend on the timing of the training loop.
+    # The shared metadata only matters for workers that receive a pickled copy of the dataset, so it makes them spawned.
+    def worker_args(self):
+        args = dict(num_workers=self.config.dloadworkers, persistent_workers=self.config.dloadworkers > 0,
+            generator=rng.torch_generator())
+        if self.config.shared_metadata and self.config.dloadworkers > 0:
+            args['multiprocessing_context'] = 'spawn'
+        return args
+
+    def get_dataloader(self, dataset):
+        if isinstance(dataset, IterableDataset):
+            if self.config.loader != 'default':
+                raise RuntimeError("celeba_shards: only implemented for loader default")
+            return torch.utils.data.DataLoader(dataset, batch_size=self.config.mini_batch_size, **self.worker_args())
+        if self.config.loader == 'default':
+            return torch.utils.data.DataLoader(dataset, 
+                batch_size=self.config.mini_batch_size, shuffle=True, collate_fn=databatch.collate, **self.worker_args())
+        if self.config.loader == 'stream':
+            if not self.config.coupled:
+                raise RuntimeError("loader stream: only implemented for coupled datasets")
+            stream = BatchStream(dataset, self.config.mini_batch_size, self.config.batches)
+            return torch.utils.data.DataLoader(stream, batch_size=None, **self.worker_args())
+        if self.config.loader == 'device':
+            steps = self.config.batches
+            if not self.config.coupled:
+                steps = len(dataset) // self.config.mini_batch_size
+            return BatchStream(dataset, self.config.mini_batch_size, steps)
+        if self.config.loader == 'thread':
+            # coupled datasets draw their samples at random, so they need no shuffled order
+            return ThreadedLoader(dataset, self.config.mini_batch_size, self.config.loadthreads,
+                shuffle=not self.config.coupled)
+        raise RuntimeError('loader argument has unknown value: ' + self.config.loader)
+
+    def get_device_dataset(self, dataset):
+        if self.config.dataname == "CelebA" or self.config.combined:
+            raise RuntimeError("loader device: only implemented for single and coupled digit datasets")
+        if self.config.coupled:
+            return DeviceCoupledDataset(DeviceDataset(dataset.dataset1), DeviceDataset(dataset.dataset2))
+        return DeviceDataset(dataset)
+
+    # The dataset and its loader are built once and reused by every call of train, so the loader workers live
+    # across epochs and training stages. Every worker holds its own copy of the dataset, so the loader is rebuilt
+    # (and its workers restarted) after set_labels or a change of config.batches.
+    def get_training_data(self):
+        if self.dataset is None:
+            self.dataset = self.get_dataset()
+        if self.dataloader is None or self.loader_batches != self.config.batches:
+            self.close_dataloader()
+            self.train_dataset = self.dataset
+            if self.config.loader == 'device':
+                self.train_dataset = self.get_device_dataset(self.dataset)
+            self.dataloader = self.get_dataloader(self.train_dataset)
+            self.loader_batches = self.config.batches
+        return self.train_dataset, self.dataloader
+
+    # Re-filters the training dataset in place
+    def set_labels(self, labels1, labels2=None):
+        self.config.labels1 = labels1
+        if not labels2 is None:
+            self.config.labels2 = labels2
+        if self.dataset is None:
+            return
+        if self.config.coupled or self.config.combined:
+            self.dataset.set_labels(self.config.labels1, self.config.labels2)
+        else:
+            self.dataset.set_labels(self.config.labels1)
+        self.close_dataloader()
+
+    # DataLoader workers stop when the loader is garbage collected, the threads of a ThreadedLoader are stopped here
+    def close_dataloader(self):
+        if isinstance(self.dataloader, ThreadedLoader):
+            self.dataloader.close()
+        self.dataloader = None
+
     def train(self):
-        dataset = self.get_dataset()
-        dataloader = torch.utils.data.DataLoader(dataset, 
-            batch_size=self.config.mini_batch_size, shuffle=True, num_workers=self.config.dloadworkers)
+        self.make_savefolder()
+        dataset, dataloader = self.get_training_data()
 
         imgsaver = Visualizer(self.config)
         trainer = GANTrainer(self.config, self.G, self.D)
 
+        prefetcher = None
+        if self.config.prefetch:
+            prefetcher = Prefetcher(self.config, dataset)
+
         epoch = 0
         steps_without_G_update = 0
-        c_fake = None
         self.D.train()
         self.G.train()
         while epoch < self.config.epochs:
             print("Epoch: "+str(epoch+1)+ "/" + str(self.config.epochs) + ' '*10)
 
-            for batch, data in enumerate(dataloader) :
+            if prefetcher is None:
+                step_inputs = steps(self.config, dataset, dataloader)
+            else:
+                step_inputs = prefetcher(dataloader)
+
+            for batch, (data, c_fake, g_inp) in enumerate(step_inputs) :
                 if batch%self.config.snap_step == 0:
                     self.make_snapshot(epoch, batch, trainer, imgsaver)
                 
                 print("\rBatch " + str(batch))
                 
-                if self.config.auxclas :
-                    c_fake = sample_c(self.config, dataset)
-                trainer.next_step(data, c_fake) # Using the same c_fake for generator and discriminator update
+                trainer.next_step(data, c_fake, g_inp) # Using the same c_fake for generator and discriminator update
 
                 if trainer.update_discriminator(self.G, self.D):
                     steps_without_G_update += 1
@@ -176,12 +283,14 @@ class GAN():
 
             self.make_snapshot(epoch, batch+1, trainer, imgsaver)
             self.save(epoch)
+            if not prefetcher is None:
+                print("Time spent waiting for data: %.2fs" % prefetcher.stall_time)
             epoch += 1
 
     #Only works for digits now
     def test_auxclas(self, dataset, eval_d, num):
         dataloader = torch.utils.data.DataLoader(dataset, 
-            batch_size=self.config.mini_batch_size, shuffle=True, num_workers=3)
+            batch_size=self.config.mini_batch_size, shuffle=True, num_workers=3, collate_fn=databatch.collate)
 
         count = {}
         correct = {}
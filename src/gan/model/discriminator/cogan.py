@@ -14,6 +14,8 @@ class Discriminator(nn.Module):
         super(Discriminator, self).__init__()
         self.auxclas = config.auxclas
         self.wasserstein = config.algorithm == 'wgan_gp'
+        self.shared_trunk = config.coupled and config.shared_trunk
+        self.per_domain_norm = per_domain_norm(config.trunk_norm)
         clen = 0
         if self.auxclas:
             self.numcats = len(config.categories)
@@ -42,7 +44,11 @@ class Discriminator(nn.Module):
         weight_init(self, config.weight_init)
 
     def single_forward(self, inp, conv0):
-        h0 = self.pool0(conv0(inp))
+        return self.trunk_forward(conv0(inp))
+
+    #the layers after conv0, which the domains share
+    def trunk_forward(self, h):
+        h0 = self.pool0(h)
         h1 = self.pool1(self.conv1(h0))
         h2 = self.prelu2(self.conv2(h1))
         out = self.conv3(h2)
@@ -56,6 +62,10 @@ class Discriminator(nn.Module):
         return (out,)
         
     def forward(self, inp_a=None, inp_b=None):
+        if self.shared_trunk and not inp_a is None and not inp_b is None:
+            hidden = [self.conv0_a(inp_a), self.conv0_b(inp_b)]
+            return tuple(shared_forward(self, self.trunk_forward, hidden, self.per_domain_norm))
+
         if not inp_a is None:
             out_a = self.single_forward(inp_a, self.conv0_a)
 
@@ -7,6 +7,8 @@ class Discriminator(nn.Module):
     def __init__(self, config):
         super(Discriminator, self).__init__() 
         self.auxclas = config.auxclas
+        self.shared_trunk = config.coupled and config.shared_trunk
+        self.per_domain_norm = per_domain_norm(config.trunk_norm)
 
         self.first_a = nn.Sequential(
             nn.Conv2d(config.imgch, config.d_dim, 4, stride=2, padding=1),
@@ -46,7 +48,10 @@ class Discriminator(nn.Module):
         weight_init(self, config.weight_init)
 
     def single_forward(self, inp, first):
-        hidden = first(inp)
+        return self.trunk_forward(first(inp))
+
+    #the layers after the first, which the domains share
+    def trunk_forward(self, hidden):
         hidden = self.main(hidden)
         s = self.predict_src(hidden)
         if self.auxclas:
@@ -55,6 +60,10 @@ class Discriminator(nn.Module):
         return (s,)
 
     def forward(self, inp_a=None, inp_b=None):
+        if self.shared_trunk and not inp_a is None and not inp_b is None:
+            hidden = [self.first_a(inp_a), self.first_b(inp_b)]
+            return tuple(shared_forward(self, self.trunk_forward, hidden, self.per_domain_norm))
+
         if not inp_a is None:
             out_a = self.single_forward(inp_a, self.first_a)
 
@@ -14,21 +14,23 @@ class Generator(nn.Module):
         super(Generator, self).__init__()
         self.auxclas = config.auxclas
         self.coupled = config.coupled
+        self.shared_trunk = config.coupled and config.shared_trunk
+        self.per_domain_norm = per_domain_norm(config.trunk_norm)
         c_len = 0
         if config.auxclas:
             c_len = sum(config.categories)
 
         self.dconv0 = Vector2FeatureMaps(config.z_len+c_len, config.g_dim*8, mode=config.g_first_layer)
-        self.bn0 = nn.BatchNorm2d(config.g_dim*8, affine=False)
+        self.bn0 = SegmentedBatchNorm2d(config.g_dim*8, affine=False)
         self.prelu0 = nn.PReLU()
         self.dconv1 = nn.ConvTranspose2d(config.g_dim*8, config.g_dim*4, kernel_size=3, stride=2, padding=1)
-        self.bn1 = nn.BatchNorm2d(config.g_dim*4, affine=False)
+        self.bn1 = SegmentedBatchNorm2d(config.g_dim*4, affine=False)
         self.prelu1 = nn.PReLU()
         self.dconv2 = nn.ConvTranspose2d(config.g_dim*4, config.g_dim*2, kernel_size=3, stride=2, padding=1)
-        self.bn2 = nn.BatchNorm2d(config.g_dim*2, affine=False)
+        self.bn2 = SegmentedBatchNorm2d(config.g_dim*2, affine=False)
         self.prelu2 = nn.PReLU()
         self.dconv3 = nn.ConvTranspose2d(config.g_dim*2, config.g_dim, kernel_size=3, stride=2, padding=1)
-        self.bn3 = nn.BatchNorm2d(config.g_dim, affine=False)
+        self.bn3 = SegmentedBatchNorm2d(config.g_dim, affine=False)
         self.prelu3 = nn.PReLU()
         self.dconv4_a = nn.ConvTranspose2d(config.g_dim, 1, kernel_size=6, stride=1, padding=1)
         if self.coupled:
@@ -39,13 +41,18 @@ class Generator(nn.Module):
         
 
     def singleForward(self, z, c=None):        
+        return self.trunkForward(self.trunkInput(z, c))
+
+    def trunkInput(self, z, c=None):
         if self.auxclas:
             inp = torch.cat((z, c), 1)
         else:
             inp = z
 
-        inp = inp.view(inp.size(0), inp.size(1), 1, 1)
+        return inp.view(inp.size(0), inp.size(1), 1, 1)
 
+    #the layers before dconv4, which the domains share
+    def trunkForward(self, inp):
         h0 = self.prelu0(self.bn0(self.dconv0(inp)))
         h1 = self.prelu1(self.bn1(self.dconv1(h0)))
         h2 = self.prelu2(self.bn2(self.dconv2(h1)))
@@ -53,6 +60,11 @@ class Generator(nn.Module):
         return h3
         
     def forward(self, z, c_a=None, c_b=None):
+        if self.shared_trunk:
+            inps = [self.trunkInput(z, c_a), self.trunkInput(z, c_b)]
+            h3_a, h3_b = shared_forward(self, self.trunkForward, inps, self.per_domain_norm)
+            return self.sig4(self.dconv4_a(h3_a)), self.sig4(self.dconv4_b(h3_b))
+
         h3_a = self.singleForward(z, c_a)
         out_a = self.sig4(self.dconv4_a(h3_a))
         if self.coupled:
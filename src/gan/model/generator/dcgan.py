@@ -8,6 +8,8 @@ class Generator(nn.Module):
         super(Generator, self).__init__()
         self.auxclas = config.auxclas
         self.coupled = config.coupled
+        self.shared_trunk = config.coupled and config.shared_trunk
+        self.per_domain_norm = per_domain_norm(config.trunk_norm)
         c_len = 0
         if config.auxclas:
             if config.dataname == 'CelebA' and config.labeltype == 'bool':
@@ -74,13 +76,17 @@ class Generator(nn.Module):
             if self.coupled:
                 inp_b = z
 
-        features_a = self.main(inp_a)
+        if self.shared_trunk:
+            features_a, features_b = shared_forward(self, self.main, [inp_a, inp_b], self.per_domain_norm)
+        else:
+            features_a = self.main(inp_a)
         out_a = self.last_a(features_a)
 
 
 
         if self.coupled:
-            features_b = self.main(inp_b)
+            if not self.shared_trunk:
+                features_b = self.main(inp_b)
             out_b = self.last_b(features_b)
             
 
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+import torch
 import torch.nn as nn
 
 class Identity(nn.Module):
@@ -15,9 +17,12 @@ class Reshape(nn.Module):
         return inp.view(self.shape)
 
 
+# With segments > 1, batch norm normalizes each of that many equal parts of the batch with its own statistics,
+# see segmented_norm
 class Norm2d(nn.Module):
     def __init__(self, dim, mode):
         super(Norm2d, self).__init__()
+        self.segments = 1
         if mode == 'batch':
             self.main = nn.BatchNorm2d(dim)
         elif mode == 'instance':
@@ -28,11 +33,12 @@ class Norm2d(nn.Module):
             raise RuntimeError('norm argument has unknown value: ' + mode)
 
     def forward(self, inp):
-        return self.main(inp)
+        return segmented_forward(self.main, inp, self.segments)
 
 class Norm1D(nn.Module):
     def __init__(self, dim, mode):
         super(Norm1D, self).__init__()
+        self.segments = 1
         if mode == 'batch':
             self.main = nn.BatchNorm1d(dim)
         elif mode == 'instance':
@@ -43,7 +49,87 @@ class Norm1D(nn.Module):
             raise RuntimeError('norm argument has unknown value: ' + mode)
 
     def forward(self, inp):
-        return self.main(inp)
+        return segmented_forward(self.main, inp, self.segments)
+
+def segmented_forward(norm, inp, segments):
+    if segments == 1 or not isinstance(norm, nn.modules.batchnorm._BatchNorm):
+        return norm(inp)
+    return torch.cat([norm(part) for part in inp.chunk(segments, 0)], 0)
+
+# nn.BatchNorm2d that can be segmented like Norm2d, for models that hold their batch norm layers directly
+class SegmentedBatchNorm2d(nn.BatchNorm2d):
+    def __init__(self, *args, **kwargs):
+        super(SegmentedBatchNorm2d, self).__init__(*args, **kwargs)
+        self.segments = 1
+
+    def forward(self, inp):
+        if self.segments == 1:
+            return super(SegmentedBatchNorm2d, self).forward(inp)
+        parts = inp.chunk(self.segments, 0)
+        return torch.cat([super(SegmentedBatchNorm2d, self).forward(part) for part in parts], 0)
+
+# Within the context, the batch norm layers of model normalize each of n equal parts of their input separately,
+# as if the parts were passed through model one after the other: every part is normalized with its own batch
+# statistics and updates the running statistics in turn. Nested contexts multiply their numbers of parts.
+# Only Norm2d, Norm1D and SegmentedBatchNorm2d can be segmented, other batch norm layers in model raise an error.
+@contextmanager
+def segmented_norm(model, n):
+    norms = [m for m in model.modules() if isinstance(m, (Norm2d, Norm1D, SegmentedBatchNorm2d))]
+    wrapped = set(id(m.main) for m in norms if not isinstance(m, SegmentedBatchNorm2d))
+    for m in model.modules():
+        if isinstance(m, nn.modules.batchnorm._BatchNorm) and not isinstance(m, SegmentedBatchNorm2d) and not id(m) in wrapped:
+            raise RuntimeError('segmented_norm: model has batch norm layers outside of Norm2d, Norm1D and SegmentedBatchNorm2d')
+    for m in norms:
+        m.segments *= n
+    try:
+        yield
+    finally:
+        for m in norms:
+            m.segments //= n
+
+#Splits the tensors in the (nested tuple) output of a model on a batch of n concatenated batches into the outputs
+#for each of them
+def split_batch(out, n):
+    if torch.is_tensor(out):
+        return out.chunk(n, 0)
+    parts = [split_batch(o, n) for o in out]
+    return [tuple(part[it] for part in parts) for it in range(n)]
+
+# For coupled models: runs trunk, the layers that the domains share, once on the concatenation of the domain batches
+# inps and returns its output for each domain. With per_domain_norm, the batch norm layers of model normalize every
+# domain with its own statistics, which gives the same results as running trunk on each batch.
+# Without it, the domains share statistics. If the batch norm layers are already segmented, e.g. by fused_D, every
+# domain batch consists of that many parts, and the parts are reordered so that each segment holds the same part of
+# all domains.
+def per_domain_norm(trunk_norm):
+    if trunk_norm == 'domain':
+        return True
+    if trunk_norm == 'joint':
+        return False
+    raise RuntimeError('trunk_norm argument has unknown value: ' + trunk_norm)
+
+def shared_forward(model, trunk, inps, per_domain_norm=True):
+    n = len(inps)
+    inp = torch.cat(inps, 0)
+    if per_domain_norm:
+        with segmented_norm(model, n):
+            out = trunk(inp)
+    else:
+        segments = norm_segments(model)
+        out = swap_parts(trunk(swap_parts(inp, n, segments)), segments, n)
+    return split_batch(out, n)
+
+def norm_segments(model):
+    return max([m.segments for m in model.modules() if isinstance(m, (Norm2d, Norm1D, SegmentedBatchNorm2d))] + [1])
+
+#Reorders the (nested tuple) batch x of a x b equal parts, ordered by a first, to be ordered by b first
+def swap_parts(x, a, b):
+    if a == 1 or b == 1:
+        return x
+    if torch.is_tensor(x):
+        size = x.size()
+        return x.view(a, b, size[0] // (a*b), *size[1:]).transpose(0, 1).reshape(size)
+    return tuple(swap_parts(part, a, b) for part in x)
 
 
 class Vector2FeatureMaps(nn.Module):
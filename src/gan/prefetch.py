@@ -0,0 +1,99 @@
+import threading
+import queue
+import time
+
+import torch
+from torch.autograd import Variable
+
+from gan.auxiliary.auxiliary import ConditionEncoder
+from gan.auxiliary.sample import sample_c, sample_z
+import utils
+
+#Yields the inputs of every training step: the real batch, c_fake and the generator input (z, conditional input).
+#Without prefetching c_fake is sampled in between steps and the generator input is left to the trainer.
+def steps(config, dataset, dataloader):
+    for data in dataloader:
+        c_fake = None
+        if config.auxclas:
+            c_fake = sample_c(config, dataset)
+        yield data, c_fake, None
+
+#Marks the tensors in xs as used by stream, so that their memory is not reused before stream is done with them
+def record_stream(xs, stream):
+    if isinstance(xs, (list, tuple)):
+        for x in xs:
+            record_stream(x, stream)
+    elif torch.is_tensor(xs) and xs.is_cuda:
+        xs.record_stream(stream)
+
+#Prepares the inputs of the next steps on a background thread while the current step computes.
+#When a GPU is available, the inputs are copied from pinned memory on a separate stream without blocking.
+#stall_time holds the time the training loop waited for its inputs during the last epoch.
+#The conditional inputs are encoded into the slots of the encoder. Up to depth queued steps, the step being prepared and
+#the step being trained hold one each. A slot is only reused after the step that held it has been trained,
+#done holds for every slot the event after which the GPU is done with it.
+class Prefetcher():
+    def __init__(self, config, dataset, depth=2):
+        self.config = config
+        self.dataset = dataset
+        self.depth = depth
+        self.stall_time = 0.0
+        self.generator = torch.Generator()
+        self.generator.manual_seed(torch.initial_seed() % 2**63)
+        self.encoder = ConditionEncoder(config, depth + 2)
+        self.done = [None] * (depth + 2)
+        self.stream = None
+        if torch.cuda.is_available():
+            self.stream = torch.cuda.Stream()
+
+    def prepare(self, data):
+        c_fake = None
+        if self.config.auxclas:
+            c_fake = sample_c(self.config, self.dataset)
+        z = torch.FloatTensor(self.config.mini_batch_size, self.config.z_len)
+        sample_z(self.config.z_distribution, z, self.generator)
+        c_fakes = c_fake if isinstance(c_fake, tuple) else (c_fake,)
+
+        slot = self.encoder.slot
+        if self.stream is None:
+            return data, c_fake, (Variable(z),) + self.encoder(*c_fakes), None, slot
+        with torch.cuda.stream(self.stream):
+            if not self.done[slot] is None:
+                self.stream.wait_event(self.done[slot])
+            g_inp = (Variable(utils.cuda_async(z)),) + self.encoder(*c_fakes)
+            data, c_fake = utils.cuda_async((data, c_fake))
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        return data, c_fake, g_inp, event, slot
+
+    def fill(self, dataloader, q):
+        try:
+            for data in dataloader:
+                q.put(self.prepare(data))
+            q.put(None)
+        except Exception as e:
+            q.put(e)
+
+    def __call__(self, dataloader):
+        self.stall_time = 0.0
+        q = queue.Queue(maxsize=self.depth)
+        thread = threading.Thread(target=self.fill, args=(dataloader, q), daemon=True)
+        thread.start()
+        while True:
+            start = time.time()
+            item = q.get()
+            self.stall_time += time.time() - start
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            data, c_fake, g_inp, event, slot = item
+            if not event is None:
+                torch.cuda.current_stream().wait_event(event)
+                record_stream(item, torch.cuda.current_stream())
+            yield data, c_fake, g_inp
+            if not event is None:
+                self.done[slot] = torch.cuda.Event()
+                self.done[slot].record(torch.cuda.current_stream())
+        thread.join()
@@ -9,9 +9,10 @@ from torch.autograd import grad
 
 import numpy as np
 
-from gan.auxiliary.auxiliary import to_one_hot
-from gan.auxiliary.sample import sample_generator_input
+from gan.auxiliary.auxiliary import ConditionEncoder
+from gan.auxiliary.sample import sample_z
 from gan.errorstorage import *
+from gan.model.helper.layers import segmented_norm, split_batch
 import utils
     
 class GANTrainer():
@@ -27,7 +28,11 @@ class GANTrainer():
         self.y_fake = utils.cuda(Variable(torch.FloatTensor(config.mini_batch_size).fill_(0.0)))
 
         self.c_fakes = self.real_fakes = (None, None)
+        self.g_out = None
+        if config.reuse_fake and (config.k != 1 or config.G_updates != 1):
+            raise RuntimeError("reuse_fake: only valid for k == 1 and G_updates == 1")
         self.z = utils.cuda(Variable(torch.FloatTensor(config.mini_batch_size, config.z_len)))
+        self.encoder = ConditionEncoder(config)
         
         #init misc
         self.s_criterion = nn.BCELoss()
@@ -46,8 +51,11 @@ class GANTrainer():
             self.__dict__[v] = utils.cuda(self.__dict__[v])
 
 #loads the 'real' data into its torch.autograd Variables
-    def next_step(self, data, c_fake_data=None): 
+#g_inp optionally holds a prepared generator input (z, conditional input) for the class vectors in c_fake_data
+    def next_step(self, data, c_fake_data=None, g_inp=None): 
         c_fake_data = utils.cuda(c_fake_data)
+        self.g_inp = g_inp
+        self.c_inp = None if g_inp is None else g_inp[1:]
         #put data into Variables
 
         if self.config.coupled:
@@ -70,6 +78,18 @@ class GANTrainer():
         if self.config.mini_batch_size != self.this_batch_size:
             print('batch size is off: ' + str(self.this_batch_size))
 
+    #The prepared generator input is used for the first generator pass of a step, later passes only sample a new z.
+    #Without a prepared input, c_fake is encoded once per step.
+    def generator_input(self):
+        if not self.g_inp is None:
+            g_inp = self.g_inp
+            self.g_inp = None
+            return g_inp
+        if self.c_inp is None:
+            self.c_inp = self.encoder(*self.c_fakes)
+        sample_z(self.config.z_distribution, self.z.data)
+        return (self.z,) + self.c_inp
+
     def get_error_storage(self):
         return self.error_storage
 
@@ -164,24 +184,38 @@ class GANTrainer():
         return error, separate_errors
 
 
+    #Runs D once on the concatenation of the batches in inp_lists, with separate batch norm statistics per batch,
+    #and returns the outputs for each of them
+    def fused_D(self, D, inp_lists):
+        n = len(inp_lists)
+        inps = tuple(torch.cat(inps, 0) for inps in zip(*inp_lists))
+        with segmented_norm(D, n):
+            out = D(*inps)
+        return split_batch(out, n)
+
     def update_discriminator(self, G, D):
         if self.config.mini_batch_size != self.this_batch_size:
             return False
         D.zero_grad()
 
-        #get fake discriminator output
-        g_inp = sample_generator_input(self.config, self.config.mini_batch_size, self.z, *self.c_fakes)
-        g_out = G(*g_inp)
+        #get fake discriminator input
+        g_inp = self.generator_input()
+        if self.config.reuse_fake and self.config.use_generator:
+            #keep the generator output and its graph for the generator update of this step
+            self.g_out = G(*g_inp)
+            g_out = self.g_out
+        else:
+            with torch.no_grad():
+                g_out = G(*g_inp)
         d_inp_fake_list = self.detach(g_out) #makes sure that the backward pass will stop at generator output
-        d_out_fake_list = D(*d_inp_fake_list)
 
-        #get real discriminator output
+        #get real discriminator input
         d_inp_real_list = (self.x1_real,) 
         if self.config.coupled:
             d_inp_real_list += (self.x2_real,)
-        d_out_real_list = D(*d_inp_real_list)
+        d_inp_lists = [d_inp_fake_list, d_inp_real_list]
 
-        #if necessary, get discriminator output of linearly interpolated points beween fake and real input 
+        #if necessary, get linearly interpolated points beween fake and real input 
         if self.config.algorithm == 'wgan_gp' or self.config.c_algorithm == 'wgan_gp':
             d_inp_hat_list = ()
             for idx in range(len(d_inp_fake_list)):
@@ -190,13 +224,23 @@ class GANTrainer():
                 x_wave = d_inp_fake_list[idx].data
                 x_hat = e*x + (1-e)*x_wave
                 d_inp_hat_list += (utils.cuda(Variable(x_hat, requires_grad=True)),)
-            d_out_hat_list = D(*d_inp_hat_list)
+            d_inp_lists += [d_inp_hat_list]
+
+        #get discriminator outputs, in the order fake, real, interpolated
+        if self.config.fused_d:
+            d_out_lists = self.fused_D(D, d_inp_lists)
+        else:
+            d_out_lists = [D(*d_inp_list) for d_inp_list in d_inp_lists]
+        d_out_fake_list, d_out_real_list = d_out_lists[:2]
+        if len(d_out_lists) > 2:
+            d_out_hat_list = d_out_lists[2]
 
         if self.config.algorithm == 'wgan_gp_old':
             src_error, _ = self.compute_D_error_WGAN_gp_old(d_inp_real_list, d_inp_fake_list, d_out_real_list, d_out_fake_list, D)
             src_error.backward()
             self.d_opt.step()
         else:
+            total_error = 0 #one backward pass for all domains, whose graphs may share layers
             for idx in range(len(d_out_real_list)):
                 d_out_real = d_out_real_list[idx]
                 d_inp_real = d_inp_real_list[idx]
@@ -228,7 +272,8 @@ class GANTrainer():
                 else:
                     self.error_storage.store_errors('D', idx, src_error)
                 
-                error.backward()
+                total_error += error
+            total_error.backward()
             self.d_opt.step()
 
         return True
@@ -240,8 +285,13 @@ class GANTrainer():
         
         # forward pass
         G.zero_grad()
-        g_inp = sample_generator_input(self.config, self.config.mini_batch_size, self.z, *self.c_fakes)
-        g_out = G(*g_inp)
+        if self.g_out is None:
+            g_inp = self.generator_input()
+            g_out = G(*g_inp)
+        else:
+            #D has been updated since, so only its pass is recomputed
+            g_out = self.g_out
+            self.g_out = None
         d_out_list = D(*g_out)
 
         # perform backward pass and update
@@ -250,6 +300,7 @@ class GANTrainer():
             sum(error).backward()
             self.g_opt.step()
         else :
+            total_error = 0 #one backward pass for all domains, whose graphs may share layers
             for idx in range(len(d_out_list)):
                 d_out = d_out_list[idx]
                 
@@ -269,8 +320,9 @@ class GANTrainer():
                     self.error_storage.store_errors('G', idx, src_error, class_error)
                 else:
                     self.error_storage.store_errors('G', idx, src_error)
-                error.backward()
+                total_error += error
             
+            total_error.backward()
             self.g_opt.step()
         
         return True
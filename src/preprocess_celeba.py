@@ -0,0 +1,21 @@
+import argparse
+
+from data.celeba import build_store
+from data.shards import build_shards
+
+# Writes center-cropped and resized copies of CelebA that CelebA_dataset reads instead of decoding the JPEGs.
+# Every size in --imsizes gets its own store, all made from a single decode of each image.
+# With --shards, packs the JPEG files into shards in that folder instead (see data/shards.py).
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Preprocess CelebA')
+    parser.add_argument('--root', type=str, default='../data/celeba/')
+    parser.add_argument('--cropsize', type=int, default=160)
+    parser.add_argument('--imsizes', nargs='+', type=int, default=[64, 32, 16])
+    parser.add_argument('--shards', type=str, default=None)
+    parser.add_argument('--shard_size', type=int, default=5000)
+    config = parser.parse_args()
+
+    if config.shards is None:
+        build_store(config.root, config.cropsize, config.imsizes)
+    else:
+        build_shards(config.root, config.shards, config.shard_size)
@@ -11,13 +11,11 @@ if __name__ == "__main__":
         gan.train()
         gan.save()
 
+        # Continue with the trained models and the same dataset, re-filtered to the new labels
         config.batches = 25000
         config.loadfolder = config.savefolder
         config.savefolder = config.savefolder+'_nofives'
-        config.labels2 = [1,2,3,4,  6,7,8,9,0]
-
-        gan = GAN(config)
-        gan.load()
+        gan.set_labels(config.labels1, [1,2,3,4,  6,7,8,9,0])
         gan.train()
         gan.save()
     else: # test
@@ -11,3 +11,16 @@ def cuda(xs):
             return tuple([cuda(x) for x in xs])
         return xs.cuda()
     return xs
+
+#Like cuda, but copies from pinned memory without blocking the host. Use from a side stream and synchronize before use.
+def cuda_async(xs):
+    if xs is None:
+        return None
+
+    if torch.cuda.is_available():
+        if isinstance(xs,(list,tuple)):
+            return type(xs)([cuda_async(x) for x in xs])
+        if xs.is_cuda:
+            return xs
+        return xs.pin_memory().cuda(non_blocking=True)
+    return xs
@@ -3,6 +3,7 @@ mpl.use('Agg')
 import matplotlib.pyplot as plt
 import warnings
 import os
+import numpy as np
 
 def prepared_error_dict(error_dict, config):
     if config.combine_gd and config.k != 1:
@@ -23,7 +24,7 @@ def prepared_error_dict(error_dict, config):
 
 
 def plot_errors(to_plot, config, label=''):
-    if type(to_plot) == list:
+    if isinstance(to_plot, (list, np.ndarray)):
         xs = range(len(to_plot))
         if 'G' in label:
             xs = [x*config.k for x in xs]
@@ -64,8 +65,9 @@ def collapse_source_class(error_dict):
 
 def combine_dicts(error_dicts):
     example = error_dicts[0]
-    if type(example) == list:
-        return [sum(x) for x in zip(*error_dicts)]
+    if isinstance(example, (list, np.ndarray)):
+        length = min(len(errors) for errors in error_dicts)
+        return sum(np.asarray(errors[:length], dtype=np.float32) for errors in error_dicts)
     #else type == dict
     return_dict = {}
     keys = example.keys()